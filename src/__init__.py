@@ -7,12 +7,23 @@
 """
 
 import os
+import json
+import time
+import argparse
 
 from data.util import *
+from data.cache import *
 from data.db_setup import *
 from manipulation.manipulation import *
+from manipulation.panel import transform_panel
+from manipulation.memo import TransformCache, transform_cached
 from analysis.analysis import *
+from analysis.significance import *
+from analysis.backtest import run_backtest, OVERLAP_RULES
 from visualization.visualization import *
+from visualization.figures import use_file_backend
+from visualization.report import render_report
+from instrumentation.instrumentation import PROFILER
 
 from dotenv import load_dotenv, find_dotenv
 
@@ -20,49 +31,314 @@ from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 API_KEY = os.getenv('API_KEY')
 
-if __name__ == "__main__":
+# Dict of all products with maps to data_id, name, sector, and exchange
+products = {'CL': [2, 'Crude', 'Energy', 'CME'],
+            'HO': [2, 'HeatOil', 'Energy', 'CME'],
+            'NG': [2, 'NatGas', 'Energy', 'CME'],
+            'GC': [2, 'Gold', 'Metals', 'CME'],
+            'SI': [2, 'Silver', 'Metals', 'CME'],
+            'AD': [2, 'Aussie', 'Forex', 'CME'],
+            'CD': [2, 'Canadien', 'Forex', 'CME'],
+            'EC': [2, 'Euro', 'Forex', 'CME'],
+            'BP': [2, 'Pound', 'Forex', 'CME'],
+            'JY': [2, 'Yen', 'Forex', 'CME'],
+            'US': [2, '30-yr', 'Treasuries', 'CME'],
+            'C': [2, 'Corn', 'Grains', 'CME'],
+            'W': [2, 'Wheat', 'Grains', 'CME'],
+            'S': [2, 'Soybeans', 'Grains', 'CME'],
+            'ES': [2, 'E-mini', 'Indexes', 'CME'],
+            'BTC': [1, 'Bitcoin', 'Cryptocurrency', 'CCAgg'],
+            'ETH': [1, 'Ethereum', 'Cryptocurrency', 'CCAgg'],
+            'XRP': [1, 'Ripple', 'Cryptocurrency', 'CCAgg'],
+            'BCH': [1, 'BitcoinCash', 'Cryptocurrency', 'CCAgg'],
+            'LTC': [1, 'Litecoin', 'Cryptocurrency', 'CCAgg'],
+            'ADA': [1, 'Cardano', 'Cryptocurrency', 'CCAgg'],
+            'NEO': [1, 'Neo', 'Cryptocurrency', 'CCAgg'],
+            'XLM': [1, 'Stellar', 'Cryptocurrency', 'CCAgg'],
+            'EOS': [1, 'EOS', 'Cryptocurrency', 'CCAgg'],
+            'XMR': [1, 'Monero', 'Cryptocurrency', 'CCAgg'],}
+
+# List of all signals explored in the analysis
+signal_list = SIGNAL_LIST
+
+def parse_args(argv=None):
+    ''' This function parses the command line arguments.  Any argument besides --help
+        selects the non-interactive batch mode, and arguments override the values in the
+        --config file.
+
+        Args: argv - list of arguments, None for sys.argv
+
+        Return: args - namespace of parsed arguments
+    '''
+    parser = argparse.ArgumentParser(description='Analysis of common technical price indicators')
+    parser.add_argument('--batch', action='store_true', help='run every stage without prompts')
+    parser.add_argument('--config', help='json file of batch settings, keys match the arguments below')
+    parser.add_argument('--db', help='SQLite3 database file to create (ex. my_new_db.sqlite)')
+    parser.add_argument('--overwrite-db', action='store_true', default=None,
+                        help='acquire the data again and replace the database, instead of loading it')
+    parser.add_argument('--refresh-db', action='store_true', default=None,
+                        help='acquire the data again and add or update its bars in the database')
+    parser.add_argument('--figures', help='folder to write figures to, figures are skipped if not set')
+    parser.add_argument('--all-figures', action='store_true', default=None,
+                        help='write the returns chart of every product/signal/timeframe and the outlier chart of '
+                             'every product too, redrawing only figures whose data changed')
+    parser.add_argument('--output', help='folder to write the returns csv files to')
+    parser.add_argument('--outliers', nargs='+', help='products to write outlier charts for')
+    parser.add_argument('--returns-plot', action='append',
+                        help='PRODUCT,SIGNAL,TIMEFRAME to write a returns chart and stats for')
+    parser.add_argument('--workers', type=int, help='worker processes for the transform stage')
+    parser.add_argument('--panel', action='store_true', default=None,
+                        help='build the indicators for all products at once on a date x symbol panel')
+    parser.add_argument('--cache', help='folder for the vendor data cache')
+    parser.add_argument('--transform-cache',
+                        help='folder to keep transformed dataframes in, so unchanged products skip the transform')
+    parser.add_argument('--horizons', nargs='+', type=int,
+                        help='report forward returns over these bar horizons (ex. 1 2 3 5 10 20 60)')
+    parser.add_argument('--bootstrap', type=int,
+                        help='number of bootstrap/random-entry samples for p-values and confidence intervals')
+    parser.add_argument('--max-p', type=float,
+                        help='only keep strategies with a p-value up to this, needs --bootstrap')
+    parser.add_argument('--backtest', action='store_true', default=None,
+                        help='backtest every product/signal with holding periods, overlap rules and costs')
+    parser.add_argument('--overlap', choices=OVERLAP_RULES,
+                        help='how the backtest handles a signal while a position is open (default skip)')
+    parser.add_argument('--commission', type=float, help='backtest commission per trade side, as a fraction (ex. 0.0005)')
+    parser.add_argument('--slippage', type=float, help='backtest slippage per trade side, as a fraction (ex. 0.0005)')
+    parser.add_argument('--compact', action='store_true', default=None,
+                        help='use float32/int8/categorical dtypes to cut memory')
+    parser.add_argument('--profile', help='.json or .csv file to write per stage and product timing, rows and peak memory to')
+    parser.add_argument('--cprofile', help='folder to write a cProfile .prof file per stage to')
+
+    args = parser.parse_args(argv)
+
+    # p-values only exist with bootstrap samples, a --config file is checked in load_config
+    if args.max_p is not None and args.bootstrap is None and args.config is None:
+        parser.error('--max-p needs --bootstrap')
+
+    return args
+
+def load_config(args):
+    ''' This function takes in the parsed arguments and returns the batch settings, read
+        from the --config file if given and overridden by any argument that was set.
+
+        Args: args - namespace of parsed arguments
+
+        Return: config - dict of batch settings
+    '''
+    config = {'db': 'price_indicator.sqlite',
+              'overwrite_db': False,
+              'refresh_db': False,
+              'figures': None,
+              'all_figures': False,
+              'output': None,
+              'outliers': [],
+              'returns_plot': [],
+              'workers': None,
+              'panel': False,
+              'cache': 'vendor_cache',
+              'transform_cache': None,
+              'compact': False,
+              'horizons': None,
+              'bootstrap': None,
+              'max_p': None,
+              'backtest': False,
+              'overlap': 'skip',
+              'commission': 0.0,
+              'slippage': 0.0,
+              'profile': None,
+              'cprofile': None}
+
+    if args.config:
+        with open(args.config) as f:
+            config.update(json.load(f))
+
+    for key in config:
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+
+    if config['max_p'] is not None and not config['bootstrap']:
+        raise ValueError('max_p needs bootstrap, the number of samples to compute p-values from')
+
+    # Allow returns plots as 'PRODUCT,SIGNAL,TIMEFRAME' strings or lists
+    config['returns_plot'] = [p.split(',') if isinstance(p, str) else p for p in config['returns_plot']]
+
+    return config
+
+def run_stage(name, func, *args, **kwargs):
+    ''' This function takes in a stage name and a function with its arguments, runs it and
+        prints how long the stage took.
+
+        Return: the return value of func
+    '''
+    print('.....{}.....'.format(name))
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    print('{} took {:.2f}s'.format(name, time.perf_counter() - start))
     print('')
-    print('This program runs an analysis of common technical price indicators on high volume futures and cryptocurrencies')
+
+    return value
+
+def print_stats_summary(stats):
+    ''' This function takes in a row of stats from return_stats and prints a summary '''
+    print('Total number of signals: {}'.format(stats[3]))
+    print('Number of signals per trading day: {0:.2f}'.format(stats[4]))
+    print('Average return: {:.2%}'.format(stats[5]))
+    print('Standard deviation of return: {:.2%}'.format(stats[6]))
+    print('Minimum return: {:.2%}'.format(stats[7]))
+    print('Maximum return: {:.2%}'.format(stats[8]))
+    print('25th percentile return: {:.2%}'.format(stats[9]))
+    print('75th percentile return: {:.2%}'.format(stats[10]))
+    print('')
+
+def figure_path(config, name):
+    ''' Return the file to write a figure to, or None when figures are skipped '''
+    if config['figures'] is None:
+        return None
+    return os.path.join(config['figures'], name)
+
+def run_batch(config):
+    ''' This function runs the entire workflow without any prompts, using the batch settings
+        in config.  Figures are written to files, or skipped if no figures folder is set.
+
+        Args: config - dict of batch settings from load_config
+
+        Return: None - runs every stage and prints timing for each
+    '''
+    # Never open a window, figures only go to files
+    use_file_backend()
+    for folder in [config['figures'], config['output']]:
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    # Figures are left to render_report when writing all of them
+    def plot(func, name, *args):
+        path = figure_path(config, name)
+        if path is not None and not config['all_figures']:
+            func(*args, save_path=path)
+
+    # Record every stage when profiling was asked for
+    if config['profile'] or config['cprofile']:
+        PROFILER.enable(memory=bool(config['profile']), cprofile=bool(config['cprofile']))
+
+    start = time.perf_counter()
+
+    # Start from an existing database, or acquire the data and create or update the database
+    sqlite_file = config['db']
+    if os.path.exists(sqlite_file) and not (config['overwrite_db'] or config['refresh_db']):
+        run_stage('Checking the SQLite3 database tables', db_setup, sqlite_file)
+        df_dict = run_stage('Loading data from the database', load_df_dict, sqlite_file,
+                            workers=config['workers'])
+    else:
+        cache = VendorCache(config['cache']) if config['cache'] else None
+        df_dict = run_stage('Acquiring and cleaning data', generate_df_dict, products, API_KEY, cache=cache)
+
+        # Create the database, or keep it and update existing bars, and insert all symbols and prices
+        if os.path.exists(sqlite_file) and config['overwrite_db']:
+            os.remove(sqlite_file)
+        run_stage('Creating the SQLite3 database tables', db_setup, sqlite_file)
+        run_stage('Inserting data into Symbols table', insert_symbols_table, products, sqlite_file)
+        run_stage('Inserting data into Daily_Prices table', insert_daily_prices_table, products, df_dict, sqlite_file)
+
+    for product in config['outliers']:
+        plot(check_outliers, 'outliers_{}.png'.format(product), df_dict[product])
+
+    if config['transform_cache']:
+        transform_cache = TransformCache(config['transform_cache'])
+        run_stage('Transforming data', transform_cached, df_dict, transform_cache, workers=config['workers'],
+                  panel=config['panel'])
+        stats = transform_cache.stats()
+        print('Transform cache: {} hits, {} misses, {} evictions'.format(stats['hits'], stats['misses'],
+                                                                        stats['evictions']))
+        print('')
+    elif config['panel']:
+        run_stage('Transforming data', transform_panel, df_dict)
+    else:
+        run_stage('Transforming data', transform_all_products, df_dict, workers=config['workers'])
+
+    if config['compact']:
+        report = compact_all_products(df_dict)
+        print('Compact dtypes saved {:,} of {:,} bytes'.format(report['bytes_saved'].sum(),
+                                                                report['bytes_before'].sum()))
+        print('')
+
+    for product, signal, timeframe in config['returns_plot']:
+        timeframe = int(timeframe)
+        plot(plot_returns, 'returns_{}_{}_{}day.png'.format(product, signal, timeframe),
+             df_dict[product], signal, timeframe)
+        print_stats_summary(return_stats(product, df_dict[product], signal, timeframe))
+
+    if config['horizons']:
+        returns_df = run_stage('Final data transformation', create_forward_returns_df, df_dict, signal_list,
+                               config['horizons'], compact=config['compact'])
+    else:
+        returns_df = run_stage('Final data transformation', create_returns_df, df_dict, signal_list,
+                               compact=config['compact'])
+
+    if config['bootstrap']:
+        returns_df = run_stage('Testing significance', add_significance, returns_df, df_dict,
+                               config['bootstrap'], workers=config['workers'],
+                               forward=bool(config['horizons']))
+
+    plot(plot_dist_ave_return, 'distplot_ave_return.png', returns_df)
+    plot(plot_ave_return_by_signal, 'stripplot_signal.png', returns_df)
+    plot(plot_heatmap, 'heatmap.png', returns_df)
+
+    df_final = run_stage('Filtering trade strategies', filter_strategies, returns_df,
+                         max_p_value=config['max_p'])
+    df_combined = run_stage('Combining trade strategies', combine_strategies, df_final)
+
+    years_map = generate_years_map(df_dict)
+    df_yearly_return = run_stage('Calculating average yearly returns', add_yearly_return, df_combined, years_map)
+    print_top_combinations(df_yearly_return)
     print('')
 
-    # Dict of all products with maps to data_id, name, sector, and exchange
-    products = {'CL': [2, 'Crude', 'Energy', 'CME'],
-                'HO': [2, 'HeatOil', 'Energy', 'CME'],
-                'NG': [2, 'NatGas', 'Energy', 'CME'],
-                'GC': [2, 'Gold', 'Metals', 'CME'],
-                'SI': [2, 'Silver', 'Metals', 'CME'],
-                'AD': [2, 'Aussie', 'Forex', 'CME'],
-                'CD': [2, 'Canadien', 'Forex', 'CME'],
-                'EC': [2, 'Euro', 'Forex', 'CME'],
-                'BP': [2, 'Pound', 'Forex', 'CME'],
-                'JY': [2, 'Yen', 'Forex', 'CME'],
-                'US': [2, '30-yr', 'Treasuries', 'CME'],
-                'C': [2, 'Corn', 'Grains', 'CME'],
-                'W': [2, 'Wheat', 'Grains', 'CME'],
-                'S': [2, 'Soybeans', 'Grains', 'CME'],
-                'ES': [2, 'E-mini', 'Indexes', 'CME'],
-                'BTC': [1, 'Bitcoin', 'Cryptocurrency', 'CCAgg'],
-                'ETH': [1, 'Ethereum', 'Cryptocurrency', 'CCAgg'],
-                'XRP': [1, 'Ripple', 'Cryptocurrency', 'CCAgg'],
-                'BCH': [1, 'BitcoinCash', 'Cryptocurrency', 'CCAgg'],
-                'LTC': [1, 'Litecoin', 'Cryptocurrency', 'CCAgg'],
-                'ADA': [1, 'Cardano', 'Cryptocurrency', 'CCAgg'],
-                'NEO': [1, 'Neo', 'Cryptocurrency', 'CCAgg'],
-                'XLM': [1, 'Stellar', 'Cryptocurrency', 'CCAgg'],
-                'EOS': [1, 'EOS', 'Cryptocurrency', 'CCAgg'],
-                'XMR': [1, 'Monero', 'Cryptocurrency', 'CCAgg'],}
-
-    # List of all signals explored in the analysis
-    signal_list = ['vol_bo_long', 'vol_bo_short',
-                   'range_bo_long', 'range_bo_short',
-                   'ma20_long', 'ma20_short',
-                   'ma50_long', 'ma50_short',
-                   'ma100_long', 'ma100_short',
-                   'bb_long', 'bb_short']
+    plot(plot_heatmap_final, 'heatmap_final.png', df_yearly_return)
+
+    if config['backtest']:
+        backtest, df_backtest = run_stage('Backtesting trade strategies', run_backtest, df_dict, signal_list,
+                                          config['horizons'] or [1, 5, 10, 20], config['overlap'],
+                                          config['commission'], config['slippage'])
+        print(df_backtest.dropna(subset=['sharpe']).sort_values(by='sharpe', ascending=False)\
+                .iloc[:10][['product', 'signal', 'holding', 'trades', 'ave_yearly_return', 'sharpe', 'max_drawdown']])
+        print('')
+
+    if config['figures'] and config['all_figures']:
+        report = run_stage('Writing all figures', render_report, config['figures'], df_dict, returns_df,
+                           df_yearly_return, workers=config['workers'])
+        print('{} figures written, {} unchanged'.format((report['status'] == 'written').sum(),
+                                                      (report['status'] == 'skipped').sum()))
+        print('')
+
+    if config['output']:
+        returns_df.to_csv(os.path.join(config['output'], 'returns.csv'), index=False)
+        df_yearly_return.to_csv(os.path.join(config['output'], 'yearly_returns.csv'), index=False)
+        if config['backtest']:
+            df_backtest.to_csv(os.path.join(config['output'], 'backtest.csv'), index=False)
+
+    if PROFILER.enabled:
+        PROFILER.disable()
+        print(PROFILER.summary())
+        print('')
+        if config['profile']:
+            PROFILER.export(config['profile'])
+        if config['cprofile']:
+            PROFILER.dump_profiles(config['cprofile'])
+
+    print('.....Program complete in {:.2f}s.....'.format(time.perf_counter() - start))
+
+def run_interactive():
+    ''' This function runs the entire workflow, prompting for the database name and which
+        charts and summaries to show.
+    '''
+    print('')
+    print('This program runs an analysis of common technical price indicators on high volume futures and cryptocurrencies')
+    print('')
 
     # Acquire data from Quandl and Cryptocompare APIs
     print('.....Acquiring and cleaning data from Quandl and Cryptocompare.....')
-    df_dict = generate_df_dict(products, API_KEY)
+    # Raw vendor data is cached on disk so repeat runs only fetch the newest bars
+    df_dict = generate_df_dict(products, API_KEY, cache=VendorCache('vendor_cache'))
     print('')
 
     # Create SQLite3 database to store price information
@@ -110,16 +386,7 @@ if __name__ == "__main__":
         print('')
         stats = return_stats(product, df_dict[product], signal, timeframe)
 
-        # Print summary
-        print('Total number of signals: {}'.format(stats[3]))
-        print('Number of signals per trading day: {0:.2f}'.format(stats[4]))
-        print('Average return: {:.2%}'.format(stats[5]))
-        print('Standard deviation of return: {:.2%}'.format(stats[6]))
-        print('Minimum return: {:.2%}'.format(stats[7]))
-        print('Maximum return: {:.2%}'.format(stats[8]))
-        print('25th percentile return: {:.2%}'.format(stats[9]))
-        print('75th percentile return: {:.2%}'.format(stats[10]))
-        print('')
+        print_stats_summary(stats)
 
     # Final data transformation to create returns dataframe
     print('.....Final data transformation.....')
@@ -159,3 +426,11 @@ if __name__ == "__main__":
     print('')
 
     print('.....Program complete.....')
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if any(value not in (None, False) for value in vars(args).values()):
+        run_batch(load_config(args))
+    else:
+        run_interactive()
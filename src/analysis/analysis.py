@@ -7,12 +7,29 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import re
 import math
 import datetime
-
-def plot_returns(df, signal, timeframe):
+import warnings
+from visualization.figures import show_or_save
+
+# Columns of each row returned by return_stats
+STATS_COLUMNS = ['product', 'signal', 'timeframe', 'signal_count', 'signals_per_day', 'ave_return',
+                 'std_return', 'min_return', 'max_return', 'q25_return', 'q75_return']
+
+# Dtypes of the returns dataframe built from return_stats rows
+RETURNS_SCHEMA = {'product': 'object', 'signal': 'object', 'timeframe': 'int64',
+                  'signal_count': 'int64', 'signals_per_day': 'float64', 'ave_return': 'float64',
+                  'std_return': 'float64', 'min_return': 'float64', 'max_return': 'float64',
+                  'q25_return': 'float64', 'q75_return': 'float64'}
+
+# Compact dtypes of the returns dataframe, for large universes
+COMPACT_RETURNS_SCHEMA = {'product': 'category', 'signal': 'category', 'timeframe': 'category',
+                          'signal_count': 'int32', 'signals_per_day': 'float32', 'ave_return': 'float32',
+                          'std_return': 'float32', 'min_return': 'float32', 'max_return': 'float32',
+                          'q25_return': 'float32', 'q75_return': 'float32'}
+
+def plot_returns(df, signal, timeframe, save_path=None):
     ''' This function takes in a dataframe of price and indicator information, as well as the
         signal and timeframe for desired analysis.  It then plots a line chart of the percent
         returns over the given timeframe, for each signal in the dataset.
@@ -20,6 +37,7 @@ def plot_returns(df, signal, timeframe):
         Args: df - dataframe of price and indicator information
               signal - string name of the desired indicator signal
               timeframe - int of number of days into the future to show returns for (1, 5, 10, 20)
+              save_path - optional file to write the plot to instead of showing it
 
         Return: None - plots the input information
     '''
@@ -39,24 +57,40 @@ def plot_returns(df, signal, timeframe):
         return 'No such trading strategy'
 
     # Plot the 1day returns
-    plt.figure(figsize=(14,7))
-
     if is_long:
-        plt.plot(df_signal.index, df_signal[returns], label='Daily Returns')
+        draw_returns(df_signal.index, df_signal[returns], mean_pc, signal, returns, save_path)
     else:
-        plt.plot(df_signal.index, -1.0 * (df_signal[returns]), label='Daily Returns')
+        draw_returns(df_signal.index, -1.0 * (df_signal[returns]), mean_pc, signal, returns, save_path)
+
+    print('Average return: {}'.format(mean_pc))
+    print('Number of trades: {}'.format(len(df_signal)))
+
+def draw_returns(dates, values, mean_pc, signal, returns, save_path=None):
+    ''' This function draws the chart of plot_returns from the signed returns of each signal
+        bar, so the returns can be computed once and drawn elsewhere (ex. by the report).
 
-    plt.plot(df_signal.index, [mean_pc]*len(df_signal[returns]),
-                color='r', linestyle='--', label='Average Return')
+        Args: dates - dates of the signal bars
+              values - signed returns of the signal bars
+              mean_pc - signed average return
+              signal - string name of the indicator signal
+              returns - name of the pct_change column, ex. 'pct_change_5day'
+              save_path - optional file to write the plot to instead of showing it
+
+        Return: None - plots the returns
+    '''
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(14,7))
+
+    plt.plot(dates, values, label='Daily Returns')
+    plt.plot(dates, [mean_pc]*len(values), color='r', linestyle='--', label='Average Return')
 
     plt.title('Returns\nStrategy: {}\nTimeframe: {}'.format(signal, returns))
     plt.xlabel('Date')
     plt.ylabel('{}'.format(returns))
     plt.legend(loc='best')
 
-    plt.show()
-    print('Average return: {}'.format(mean_pc))
-    print('Number of trades: {}'.format(len(df_signal)))
+    show_or_save(save_path)
 
 def return_stats(product, df, signal, timeframe=1):
     ''' This function takes in a product, dataframe of price and indicator information, as well as a
@@ -95,14 +129,99 @@ def return_stats(product, df, signal, timeframe=1):
 
     return [product, signal, timeframe, signal_count, signals_per_day, mean_pc, std_pc, min_pc, max_pc, q25_pc, q75_pc]
 
-def price_volatility_summary(df):
+def signal_direction(signal):
+    ''' This function takes in a signal name and returns 1.0 for a long signal, -1.0 for a
+        short signal and None for anything else.
+    '''
+    if re.search('long$', signal):
+        return 1.0
+    elif re.search('short$', signal):
+        return -1.0
+    else:
+        return None
+
+def batch_return_stats(product, df, signal_list, timeframe_list=[1, 5, 10, 20], chunk_size=256, returns=None):
+    ''' This function takes in a product, a dataframe of price and indicator information and
+        lists of signals and timeframes, and computes the same statistics as return_stats for
+        every signal/timeframe combination at once.  The signal columns are stacked against
+        the return columns into a (bars x signals x timeframes) array with the returns masked
+        to NaN where a signal is off, so every statistic is one reduction over the bar axis.
+        The array is built in blocks of at most chunk_size signal/timeframe columns, split
+        over the timeframes too, so memory stays bounded for any number of horizons.
+
+        Args: product - product name
+              df - dataframe of price and indicator information
+              signal_list - list of strings of signal names
+              timeframe_list - list of ints that represent timeframes for returns
+              chunk_size - max number of signal/timeframe columns stacked at a time, to
+                           bound memory
+              returns - optional (bars x timeframes) array of returns for timeframe_list, ex.
+                        from forward_return_matrix, None to use the pct_change columns of df
+
+        Return: stats_df - dataframe with STATS_COLUMNS, one row per signal/timeframe in the
+                           same order as calling return_stats in a loop
+    '''
+    # Keep only signals with a direction, like return_stats
+    signals = [sig for sig in signal_list if signal_direction(sig) is not None]
+    if returns is None:
+        returns = df[['pct_change_{}day'.format(tf) for tf in timeframe_list]].to_numpy(dtype=np.float64)
+
+    n_sig, n_tf = len(signals), len(timeframe_list)
+    stats = np.full((6, n_sig, n_tf), np.nan)
+    counts = np.zeros(n_sig, dtype=np.int64)
+
+    # Timeframes and signals per block, so each block has at most chunk_size columns
+    tf_step = max(1, min(n_tf, chunk_size))
+    sig_step = max(1, chunk_size // tf_step)
+
+    for start in range(0, n_sig, sig_step):
+        chunk = signals[start:start + sig_step]
+        on = (df[chunk].to_numpy() == 1)
+        counts[start:start + len(chunk)] = on.sum(axis=0)
+
+        for tf_start in range(0, n_tf, tf_step):
+            # Mask returns where the signal is off: bars x signals x timeframes
+            masked = np.where(on[:, :, None], returns[:, None, tf_start:tf_start + tf_step], np.nan)
+
+            # Empty or single value slices give NaN like pandas, silence numpy's warnings
+            with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                block = stats[:, start:start + len(chunk), tf_start:tf_start + tf_step]
+                block[0] = np.nanmean(masked, axis=0)
+                block[1] = np.nanstd(masked, axis=0, ddof=1)
+                block[2] = np.nanmin(masked, axis=0)
+                block[3] = np.nanmax(masked, axis=0)
+                block[4:6] = np.nanquantile(masked, [0.25, 0.75], axis=0)
+
+    # Flip the sign of the mean for short signals
+    stats[0] *= np.array([signal_direction(sig) for sig in signals])[:, None]
+
+    # Assemble all rows at once, signals outer and timeframes inner
+    stats_df = pd.DataFrame({'product': product,
+                             'signal': np.repeat(signals, n_tf),
+                             'timeframe': np.tile(timeframe_list, n_sig),
+                             'signal_count': np.repeat(counts, n_tf),
+                             'signals_per_day': np.repeat(counts / len(df), n_tf),
+                             'ave_return': stats[0].ravel(),
+                             'std_return': stats[1].ravel(),
+                             'min_return': stats[2].ravel(),
+                             'max_return': stats[3].ravel(),
+                             'q25_return': stats[4].ravel(),
+                             'q75_return': stats[5].ravel()}, columns=STATS_COLUMNS)
+
+    return stats_df
+
+def price_volatility_summary(df, save_path=None):
     ''' This function takes in a dataframe of price and indicator info and returns a
         summary of average monthly price data vs average monthly volatility.
 
         Args: df - dataframe to summarize
+              save_path - optional file to write the plot to instead of showing it
 
         Return: None - prints summary of price vs volatility on monthly basis
     '''
+    import matplotlib.pyplot as plt
+
     cpy = df.copy()
 
     # Add 20day historical volatility as a column to the dataframe
@@ -117,16 +236,19 @@ def price_volatility_summary(df):
 
     plt.scatter(hist_vol_monthly, price_monthly)
 
-    plt.show()
+    show_or_save(save_path)
 
-def indicator_summary(df):
+def indicator_summary(df, save_path=None):
     ''' This function takes in a dataframe of price and indicator data and returns a
         summary of the number of trades over the time period for all indicators.
 
         Args: df - the dataframe to summarize indicator data on
+              save_path - optional file to write the plot to instead of showing it
 
         Return: None - prints summary and visualization of trade data
     '''
+    import matplotlib.pyplot as plt
+
     # Modify dataframe to include only trade signal columns
     df_signals = df[['vol_bo_long', 'vol_bo_short', 'range_bo_long', 'range_bo_short',
                      'ma20_long', 'ma20_short', 'ma50_long', 'ma50_short' 'ma100_long',
@@ -139,7 +261,7 @@ def indicator_summary(df):
     # Plot histogram of number of trades for different signals
     plt.figure(figsize=(10,7))
     plt.bar(signal_names, signal_counts)
-    plt.show()
+    show_or_save(save_path)
 
 def price_summary(df):
     ''' This function takes in a dataframe and returns a summary of the overall price
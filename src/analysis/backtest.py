@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the event backtester, which turns the signal columns of the
+    transformed product dataframes into positions held for a number of bars and measures
+    them net of costs.  Unlike ave_return, which counts every signal bar as its own trade,
+    overlapping signals follow one of OVERLAP_RULES, commissions and slippage are charged on
+    every change of position, and each product/signal/holding period gets an equity curve,
+    drawdowns and a Sharpe ratio.  Every product, signal and holding period is one row of
+    (rows x bars) arrays, so the whole universe is run with a few array operations.
+"""
+
+import numpy as np
+import pandas as pd
+from analysis.analysis import signal_direction
+from manipulation.manipulation import SIGNAL_LIST
+from manipulation.panel import Panel
+from instrumentation.instrumentation import PROFILER
+
+# How a signal is handled while a position from an earlier signal is still open:
+#   skip - ignore it, so trades never overlap and each lasts exactly the holding period
+#   extend - hold until the holding period after the latest signal, one unit at most
+#   stack - open another unit, every signal is its own trade like ave_return
+OVERLAP_RULES = ['skip', 'extend', 'stack']
+
+# Columns of the dataframe returned by Backtest.summary
+BACKTEST_COLUMNS = ['product', 'signal', 'holding', 'trades', 'exposure', 'total_return', 'ave_yearly_return',
+                    'ann_volatility', 'sharpe', 'max_drawdown']
+
+def window_count(entries, hold):
+    ''' This function takes in a (rows x bars) boolean array of entry bars and a holding
+        period, and returns the number of entries in the hold bars ending at each bar, which
+        is the number of trades open over the bar after it.
+    '''
+    cs = np.cumsum(entries, axis=1, dtype=np.int32)
+    count = cs.copy()
+    count[:, hold:] -= cs[:, :-hold]
+
+    return count
+
+def non_overlapping(on, hold):
+    ''' This function takes in a (rows x bars) boolean array of signal bars and a holding
+        period, and returns the entry bars of trades that never overlap: the first signal is
+        taken, signals before its exit are ignored, and the next signal at or after the exit
+        bar is taken.  The next entry after every bar is found with one reverse running
+        minimum, then all rows step from entry to entry together, so the loop runs once per
+        trade of the busiest row instead of once per bar.
+
+        Args: on - (rows x bars) boolean numpy array, True on signal bars
+              hold - number of bars each trade is held for
+
+        Return: entries - (rows x bars) boolean numpy array, True on taken entries
+    '''
+    n_rows, n_bars = on.shape
+
+    # Next signal at or after each bar, n_bars if there is none
+    idx = np.where(on, np.arange(n_bars), n_bars)
+    next_signal = np.full((n_rows, n_bars + 1), n_bars)
+    next_signal[:, :n_bars] = np.minimum.accumulate(idx[:, ::-1], axis=1)[:, ::-1]
+
+    # Next entry allowed after an entry on each bar
+    after = next_signal[:, np.minimum(np.arange(n_bars) + hold, n_bars)]
+
+    entries = np.zeros((n_rows, n_bars), dtype=bool)
+    rows = np.arange(n_rows)
+    current = next_signal[:, 0]
+
+    # Step every row with an open chain of trades to its next entry
+    active = current < n_bars
+    rows, current = rows[active], current[active]
+    while len(rows):
+        entries[rows, current] = True
+        current = after[rows, current]
+        active = current < n_bars
+        rows, current = rows[active], current[active]
+
+    return entries
+
+class Backtest(object):
+    ''' This class holds the backtest of every product/signal/holding period combination.
+        A signal on bar t enters on the close of bar t, like the returns of return_stats, and
+        a position held over a bar earns the close to close return of the next bar, so no
+        signal uses information from after it.  Commission and slippage are fractions of the
+        traded value, charged on the bar the position changes.
+
+        Results are (products x signals x holding periods x bars) arrays on each product's
+        own bars, NaN after its last bar.
+
+        Args: products - list of product symbols
+              signals - list of signals, only signals with a long or short direction
+              holding_periods - list of ints of bars to hold each trade for
+              dates - list of the DatetimeIndex of each product
+              position - signed number of units held over the bar after each bar
+              returns - net return of each bar
+              trades - (products x signals x holding periods) int array of trades opened
+              periods_per_year - number of bars in a year, for annualizing
+    '''
+
+    def __init__(self, products, signals, holding_periods, dates, position, returns, trades, periods_per_year=260):
+        self.products = list(products)
+        self.signals = list(signals)
+        self.holding_periods = list(holding_periods)
+        self.dates = dates
+        self.position = position
+        self.returns = returns
+        self.trades = trades
+        self.periods_per_year = periods_per_year
+
+        # Equity of one unit of capital and its drawdown from the running peak
+        self.equity = np.cumprod(1.0 + np.nan_to_num(returns), axis=-1)
+        self.equity[np.isnan(returns)] = np.nan
+        self.drawdown = self.equity / np.fmax.accumulate(self.equity, axis=-1) - 1.0
+
+    @classmethod
+    def from_dict(cls, prod_dict, signal_list=SIGNAL_LIST, holding_periods=[1, 5, 10, 20], overlap='skip',
+                  commission=0.0, slippage=0.0, periods_per_year=260):
+        ''' This function takes in a dict of transformed product dataframes and runs the
+            backtest of every product, signal and holding period.  The frames can be indexed
+            like any vendor's data (ex. datetime.date objects for crypto and a DatetimeIndex
+            for futures in the same dict), the dates of the results are DatetimeIndexes.
+
+            Args: prod_dict - dict of product symbols mapped to dataframes of price and signals
+                  signal_list - list of signals to trade, signals without a direction are left out
+                  holding_periods - list of ints of bars to hold each trade for
+                  overlap - one of OVERLAP_RULES
+                  commission - commission per trade side, as a fraction of the traded value
+                  slippage - slippage per trade side, as a fraction of the traded value
+                  periods_per_year - number of bars in a year, for annualizing
+
+            Return: backtest - Backtest of every combination
+        '''
+        if overlap not in OVERLAP_RULES:
+            raise ValueError('overlap must be one of {}, not {}'.format(OVERLAP_RULES, overlap))
+
+        signals = [sig for sig in signal_list if signal_direction(sig) is not None]
+        panel = Panel.from_dict(prod_dict, ['close'] + signals)
+        n_prod, n_sig, n_hold = len(panel.symbols), len(signals), len(holding_periods)
+
+        with PROFILER.stage('backtest', rows=int(panel.mask.sum()) * n_sig * n_hold):
+            # Close to close return of the bar after each bar, NaN on each product's last bar
+            close = panel.pack('close')
+            n_bars = close.shape[1]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                bar_return = np.full(close.shape, np.nan)
+                bar_return[:, :-1] = close[:, 1:] / close[:, :-1] - 1.0
+
+            # Signal bars and directions of every product/signal row
+            on = np.stack([panel.pack(sig) == 1 for sig in signals], axis=1).reshape(n_prod * n_sig, n_bars)
+            directions = np.tile([signal_direction(sig) for sig in signals], n_prod)[:, None]
+            row_return = np.repeat(bar_return, n_sig, axis=0)
+
+            position = np.empty((n_prod, n_sig, n_hold, n_bars))
+            returns = np.empty((n_prod, n_sig, n_hold, n_bars))
+            trades = np.empty((n_prod, n_sig, n_hold), dtype=np.int64)
+
+            for k, hold in enumerate(holding_periods):
+                # Entries of every trade and the number of units open over each bar
+                entries = non_overlapping(on, hold) if overlap == 'skip' else on
+                units = window_count(entries, hold)
+                if overlap == 'extend':
+                    units = np.minimum(units, 1)
+                    count = np.diff(units, axis=1, prepend=0) > 0
+                else:
+                    count = entries
+
+                pos = directions * units
+
+                # Gross return less the cost of every change of position
+                turnover = np.abs(np.diff(pos, axis=1, prepend=0.0))
+                net = pos * row_return - (commission + slippage) * turnover
+
+                position[:, :, k] = np.where(np.isnan(bar_return)[:, None], np.nan,
+                                             pos.reshape(n_prod, n_sig, n_bars))
+                returns[:, :, k] = net.reshape(n_prod, n_sig, n_bars)
+                trades[:, :, k] = count.sum(axis=1).reshape(n_prod, n_sig)
+
+        dates = [panel.dates[panel.mask[:, j]] for j in range(n_prod)]
+
+        return cls(panel.symbols, signals, holding_periods, dates, position, returns, trades, periods_per_year)
+
+    def summary(self):
+        ''' This function returns the performance of every product/signal/holding period
+            combination, with returns as fractions of the starting capital.
+
+            Return: summary_df - dataframe with BACKTEST_COLUMNS
+        '''
+        valid = ~np.isnan(self.returns)
+        bars = valid.sum(axis=-1)
+        n_rows = len(self.signals) * len(self.holding_periods)
+
+        # Equity on the last bar with a return of each row, products end on different bars
+        last = valid.shape[-1] - 1 - np.argmax(valid[..., ::-1], axis=-1)
+        final = np.where(bars > 0, np.take_along_axis(self.equity, last[..., None], axis=-1)[..., 0], np.nan)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            years = bars / self.periods_per_year
+            mean = np.nanmean(np.where(valid, self.returns, np.nan), axis=-1)
+            std = np.nanstd(self.returns, axis=-1, ddof=1)
+            exposure = np.sum(valid & (self.position != 0), axis=-1) / bars
+
+            summary_df = pd.DataFrame({'product': np.repeat(self.products, n_rows),
+                                       'signal': np.tile(np.repeat(self.signals, len(self.holding_periods)),
+                                                         len(self.products)),
+                                       'holding': np.tile(self.holding_periods, len(self.products) * len(self.signals)),
+                                       'trades': self.trades.ravel(),
+                                       'exposure': exposure.ravel(),
+                                       'total_return': (final - 1.0).ravel(),
+                                       'ave_yearly_return': (final ** (1.0 / years) - 1.0).ravel(),
+                                       'ann_volatility': (std * np.sqrt(self.periods_per_year)).ravel(),
+                                       'sharpe': (mean / std * np.sqrt(self.periods_per_year)).ravel(),
+                                       'max_drawdown': np.nanmin(self.drawdown, axis=-1).ravel()},
+                                      columns=BACKTEST_COLUMNS)
+
+        return summary_df
+
+    def curve(self, product, signal, holding):
+        ''' This function returns the bar by bar backtest of one product/signal/holding period.
+
+            Args: product - product symbol
+                  signal - signal name
+                  holding - holding period
+
+            Return: curve_df - dataframe of position, return, equity and drawdown on the
+                               product's dates
+        '''
+        i = self.products.index(product)
+        j = self.signals.index(signal)
+        k = self.holding_periods.index(holding)
+        n = len(self.dates[i])
+
+        return pd.DataFrame({'position': self.position[i, j, k, :n],
+                             'return': self.returns[i, j, k, :n],
+                             'equity': self.equity[i, j, k, :n],
+                             'drawdown': self.drawdown[i, j, k, :n]}, index=self.dates[i])
+
+def run_backtest(prod_dict, signal_list=SIGNAL_LIST, holding_periods=[1, 5, 10, 20], overlap='skip',
+                 commission=0.0, slippage=0.0, periods_per_year=260):
+    ''' This function takes in a dict of transformed product dataframes and backtests every
+        product, signal and holding period, with the same arguments as Backtest.from_dict.
+
+        Return: backtest - Backtest of every combination, for equity curves
+                summary_df - dataframe with BACKTEST_COLUMNS, one row per combination
+    '''
+    backtest = Backtest.from_dict(prod_dict, signal_list, holding_periods, overlap, commission, slippage,
+                                  periods_per_year)
+
+    return backtest, backtest.summary()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the significance tests for signal returns.  For every product,
+    signal and timeframe of a returns dataframe it bootstraps a confidence interval of the
+    average return and compares the average return against random entries.  The random draws
+    of a product are shared by all of its signals and timeframes, so each test is a slice of
+    a few batched numpy array operations instead of a Python loop per resample.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from analysis.analysis import signal_direction
+from manipulation.manipulation import forward_return_matrix
+
+# Max number of (resamples x bars) values held in memory at once
+MAX_BLOCK = 4000000
+
+def bootstrap_means(returns, on, n_boot, rng):
+    ''' This function takes in a (bars x timeframes) array of returns and a (bars x signals)
+        mask of signal bars, and returns the mean return of n_boot Poisson bootstrap resamples
+        for every signal and timeframe.  Each resample weights every bar by a Poisson(1) count,
+        which matches resampling the signal bars with replacement for all but tiny samples,
+        and lets all signals and timeframes be summed with one matrix product.
+
+        Args: returns - (bars x timeframes) numpy array, NaN where there is no return
+              on - (bars x signals) boolean numpy array, True on signal bars
+              n_boot - number of resamples
+              rng - numpy random Generator
+
+        Return: means - (n_boot x signals x timeframes) numpy array of resampled means
+    '''
+    n_bars, n_tf = returns.shape
+    n_sig = on.shape[1]
+
+    # Signal returns and counts for every signal/timeframe pair: bars x (signals x timeframes)
+    valid = ~np.isnan(returns)
+    mask = (on[:, :, None] & valid[:, None, :]).reshape(n_bars, -1).astype(np.float64)
+    values = (np.where(valid, returns, 0.0)[:, None, :] * on[:, :, None]).reshape(n_bars, -1)
+
+    means = np.empty((n_boot, n_sig * n_tf))
+    rows = max(1, MAX_BLOCK // max(n_bars, 1))
+
+    for start in range(0, n_boot, rows):
+        stop = min(start + rows, n_boot)
+        weights = rng.poisson(1.0, size=(stop - start, n_bars)).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[start:stop] = (weights @ values) / (weights @ mask)
+
+    return means.reshape(n_boot, n_sig, n_tf)
+
+def random_entry_means(returns, counts, n_boot, rng):
+    ''' This function takes in a (bars x timeframes) array of returns and a (signals x
+        timeframes) array of signal counts, and returns the mean return of n_boot random
+        entries for every signal and timeframe, each the same number of bars as the signal
+        drawn without replacement from all bars with a return.  Every resample is one random
+        order of the bars, and the running sum along it gives the mean of the first count
+        bars for any count.
+
+        Args: returns - (bars x timeframes) numpy array, NaN where there is no return
+              counts - (signals x timeframes) int numpy array of signal bars with a return
+              n_boot - number of resamples
+              rng - numpy random Generator
+
+        Return: means - (n_boot x signals x timeframes) numpy array of random entry means
+    '''
+    n_bars, n_tf = returns.shape
+    means = np.full((n_boot,) + counts.shape, np.nan)
+    rows = max(1, MAX_BLOCK // max(n_bars, 1))
+
+    for start in range(0, n_boot, rows):
+        stop = min(start + rows, n_boot)
+
+        # One random order of all bars per resample, shared by every timeframe
+        order = rng.permuted(np.tile(np.arange(n_bars), (stop - start, 1)), axis=1)
+
+        for j in range(n_tf):
+            valid = ~np.isnan(returns[:, j])
+            n_valid = int(valid.sum())
+            if not n_valid:
+                continue
+
+            # Keep the bars with a return, which stay in random order
+            kept = order[valid[order]].reshape(stop - start, n_valid)
+            running = np.cumsum(returns[kept, j], axis=1)
+
+            take = counts[:, j]
+            ok = (take > 0) & (take <= n_valid)
+            means[start:stop, ok, j] = running[:, take[ok] - 1] / take[ok]
+
+    return means
+
+def product_significance(task):
+    ''' This is a helper function to use as a process pool task.  It takes in a tuple of
+        (product dataframe, signals, timeframes, n_boot, alpha, seed, forward) and tests every
+        signal/timeframe pair of the product.
+
+        Return: results - dict of (signal, timeframe) to (p_value, ci_low, ci_high)
+    '''
+    df, signals, timeframes, n_boot, alpha, seed, forward = task
+    rng = np.random.default_rng(seed)
+
+    # Returns of every bar over every timeframe
+    if forward:
+        returns = forward_return_matrix(df['close'], timeframes)
+    else:
+        returns = df[['pct_change_{}day'.format(tf) for tf in timeframes]].to_numpy(dtype=np.float64)
+
+    on = df[signals].to_numpy() == 1
+    directions = np.array([signal_direction(sig) for sig in signals])[:, None]
+
+    # Observed signed mean and count of signal bars with a return
+    valid = ~np.isnan(returns)
+    counts = (on[:, :, None] & valid[:, None, :]).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = directions * (on.T.astype(np.float64) @ np.where(valid, returns, 0.0)) / counts
+
+    # Bootstrap confidence intervals
+    boot = directions * bootstrap_means(returns, on, n_boot, rng)
+    ci_low, ci_high = np.nanpercentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+
+    # One-sided, add-one smoothed p-value against random entries
+    random = directions * random_entry_means(returns, counts, n_boot, rng)
+    p_value = (1.0 + np.sum(random >= observed, axis=0)) / (n_boot + 1.0)
+
+    results = {}
+    for i, signal in enumerate(signals):
+        for j, timeframe in enumerate(timeframes):
+            if counts[i, j] < 2:
+                results[(signal, timeframe)] = (np.nan, np.nan, np.nan)
+            else:
+                results[(signal, timeframe)] = (p_value[i, j], ci_low[i, j], ci_high[i, j])
+
+    return results
+
+def add_significance(returns_df, prod_dict, n_boot=1000, alpha=0.05, seed=0, workers=None, forward=False):
+    ''' This function takes in a returns dataframe from create_returns_df and the dict of
+        transformed product dataframes it was built from, and adds p_value, ci_low and ci_high
+        columns for every product/signal/timeframe row.  The confidence interval is for the
+        signed ave_return, and the p-value is the share of random entries with the same number
+        of bars that did at least as well.  Products are tested in parallel when workers is
+        more than 1, and results are repeatable for a given seed.
+
+        Args: returns_df - dataframe of products, signals, timeframes and return stats
+              prod_dict - dict of product symbols mapped to dataframes of price info
+              n_boot - number of bootstrap and random-entry samples per row
+              alpha - confidence intervals cover 1 - alpha
+              seed - base seed, product i uses seed + i
+              workers - number of worker processes, None or 1 to test serially
+              forward - True if returns_df was built by create_forward_returns_df
+
+        Return: returns_df - copy of returns_df with p_value, ci_low and ci_high columns
+    '''
+    # One task per product with all of its signals and timeframes
+    products, tasks = [], []
+    for i, prod in enumerate(prod_dict):
+        rows = returns_df[returns_df['product'] == prod]
+        if len(rows):
+            signals = list(pd.unique(rows['signal'].astype(str)))
+            timeframes = sorted(int(tf) for tf in pd.unique(rows['timeframe']))
+            products.append(prod)
+            tasks.append((prod_dict[prod], signals, timeframes, n_boot, alpha, seed + i, forward))
+
+    if not workers or workers <= 1:
+        results = [product_significance(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(product_significance, tasks))
+
+    # Look up the result of every row
+    lookup = {}
+    for prod, result in zip(products, results):
+        for (signal, timeframe), values in result.items():
+            lookup[(prod, signal, timeframe)] = values
+
+    nan_row = (np.nan, np.nan, np.nan)
+    values = [lookup.get((prod, str(sig), int(tf)), nan_row) for prod, sig, tf in
+              zip(returns_df['product'], returns_df['signal'], returns_df['timeframe'])]
+
+    returns_df = returns_df.copy()
+    returns_df[['p_value', 'ci_low', 'ci_high']] = np.array(values, dtype=np.float64).reshape(-1, 3)
+
+    return returns_df
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module benchmarks every stage of the pipeline on deterministic synthetic data, so
+    speedups and regressions can be measured without vendor access or input prompts.  Run
+    it from the src folder with: python -m benchmark.benchmark --symbols 25 --bars 5000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+import tracemalloc
+import pandas as pd
+
+from data.util import *
+from data.db_setup import *
+from data.synthetic import *
+from data.cleaning import clean_universe
+from manipulation.manipulation import *
+from manipulation.panel import transform_panel
+from manipulation.memo import TransformCache, transform_cached
+from analysis.backtest import run_backtest
+
+# Libraries that only plotting and vendor downloads need
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'scipy', 'quandl', 'requests']
+
+# Max seconds to import each compute module in a fresh interpreter, with no heavy module
+IMPORT_BUDGET = {'data.util': 0.6,
+                 'data.cleaning': 0.6,
+                 'manipulation.manipulation': 0.6,
+                 'manipulation.panel': 0.6,
+                 'manipulation.memo': 0.6,
+                 'analysis.analysis': 0.6,
+                 'analysis.significance': 0.6,
+                 'analysis.backtest': 0.6,
+                 'visualization.visualization': 0.6}
+
+# Run in a fresh interpreter to time one import and list the heavy modules it loaded
+IMPORT_SCRIPT = ('import sys, json, time\n'
+                 'start = time.perf_counter()\n'
+                 '__import__(sys.argv[1])\n'
+                 'seconds = time.perf_counter() - start\n'
+                 'heavy = [m for m in sys.argv[2:] if m in sys.modules]\n'
+                 'print(json.dumps([seconds, heavy]))\n')
+
+def time_imports(budget=IMPORT_BUDGET, repeat=3):
+    ''' This function imports each module of budget in a fresh interpreter, like a process pool
+        child would, and checks it against its time budget and for heavy modules.  The best
+        of repeat runs is kept, so a busy machine does not fail the check.
+
+        Args: budget - dict of module names mapped to max seconds to import them
+              repeat - number of fresh interpreters to time each module in
+
+        Return: imports_df - dataframe of module, seconds, budget, heavy modules loaded and
+                             whether it is within budget
+    '''
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for module, limit in budget.items():
+        best, heavy = None, []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT, module] + HEAVY_MODULES,
+                                 cwd=src, capture_output=True, text=True, check=True).stdout
+            seconds, heavy = json.loads(out.splitlines()[-1])
+            best = seconds if best is None else min(best, seconds)
+        rows.append([module, best, limit, ', '.join(heavy), best <= limit and not heavy])
+
+    return pd.DataFrame(rows, columns=['module', 'seconds', 'budget', 'heavy', 'ok'])
+
+def time_stage(results, stage, func, rows, memory=True):
+    ''' This function takes in a list of results, a stage name, a function with no arguments
+        and the number of rows the stage processes.  It runs the function, appends the wall
+        time, throughput and peak traced memory of the stage to results and returns the
+        function's return value.
+
+        Args: results - list of dicts to append the stage result to
+              stage - name of the stage
+              func - function to run
+              rows - number of rows processed by the stage, used for throughput
+              memory - trace peak memory with tracemalloc, which adds some overhead
+
+        Return: the return value of func
+    '''
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    results.append({'stage': stage, 'seconds': seconds, 'rows': rows,
+                    'rows_per_sec': rows / seconds if seconds else float('inf'), 'peak_mb': peak})
+
+    return value
+
+def clean_df_dict(product_dict, df_dict):
+    ''' This function applies the same cleaning as generate_df_dict to a dict of raw
+        dataframes, without fetching anything.
+
+        Args: product_dict - a dict of symbols for products with maps to a list of info
+              df_dict - a dictionary of symbols mapped to raw dataframes
+
+        Return: df_dict - a dictionary of symbols mapped to cleaned dataframes
+    '''
+    return clean_universe(product_dict, df_dict)[0]
+
+def run_benchmark(n_symbols=25, n_bars=5000, seed=0, memory=True, sqlite_file=None):
+    ''' This function generates n_symbols x n_bars of synthetic data and times each stage of
+        the pipeline on it.
+
+        Args: n_symbols - number of synthetic symbols
+              n_bars - number of daily bars per symbol
+              seed - base seed for the synthetic data
+              memory - trace peak memory of each stage
+              sqlite_file - database file for the insert stage, None for a temp file
+
+        Return: results_df - dataframe of stage, seconds, rows, rows_per_sec and peak_mb
+    '''
+    results = []
+    product_dict = synthetic_products(n_symbols)
+    raw_dict = generate_synthetic_df_dict(product_dict, n_bars, seed)
+    total_rows = n_symbols * n_bars
+
+    # Clean the raw data like generate_df_dict
+    df_dict = time_stage(results, 'clean', lambda: clean_df_dict(product_dict, raw_dict),
+                         total_rows, memory)
+    total_rows = sum(len(df) for df in df_dict.values())
+
+    # Create the database and insert symbols and prices
+    tmp_dir = None
+    if sqlite_file is None:
+        tmp_dir = tempfile.mkdtemp()
+        sqlite_file = os.path.join(tmp_dir, 'benchmark.sqlite')
+
+    def insert():
+        db_setup(sqlite_file)
+        insert_symbols_table(product_dict, sqlite_file)
+        insert_daily_prices_table(product_dict, df_dict, sqlite_file)
+
+    time_stage(results, 'sqlite_insert', insert, total_rows, memory)
+
+    if tmp_dir is not None:
+        os.remove(sqlite_file)
+        os.rmdir(tmp_dir)
+
+    # Transform the data, on a panel of all products and per product, and build the returns frame
+    time_stage(results, 'transform_panel', lambda: transform_panel({prod: df.copy() for prod, df in df_dict.items()}),
+               total_rows, memory)
+
+    # Transform through an empty memo cache, the cost of a first run with --transform-cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        time_stage(results, 'transform_cached',
+                   lambda: transform_cached({prod: df.copy() for prod, df in df_dict.items()}, TransformCache(cache_dir)),
+                   total_rows, memory)
+    time_stage(results, 'add_all_indicators', lambda: transform_all_products(df_dict), total_rows, memory)
+    returns_df = time_stage(results, 'create_returns_df', lambda: create_returns_df(df_dict, SIGNAL_LIST),
+                            total_rows, memory)
+
+    # Filter and combine strategies, then add yearly returns
+    df_final = time_stage(results, 'filter_strategies', lambda: filter_strategies(returns_df),
+                          len(returns_df), memory)
+    df_combined = time_stage(results, 'combine_strategies', lambda: combine_strategies(df_final),
+                             len(df_final), memory)
+    time_stage(results, 'add_yearly_return',
+               lambda: add_yearly_return(df_combined, generate_years_map(df_dict)),
+               len(df_combined), memory)
+    time_stage(results, 'run_backtest', lambda: run_backtest(df_dict, SIGNAL_LIST, commission=0.0005, slippage=0.0005),
+               total_rows, memory)
+
+    return pd.DataFrame(results, columns=['stage', 'seconds', 'rows', 'rows_per_sec', 'peak_mb'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on synthetic data')
+    parser.add_argument('--symbols', type=int, default=25, help='number of synthetic symbols')
+    parser.add_argument('--bars', type=int, default=5000, help='number of daily bars per symbol')
+    parser.add_argument('--seed', type=int, default=0, help='base seed for the synthetic data')
+    parser.add_argument('--no-memory', action='store_true', help='skip peak memory tracing')
+    parser.add_argument('--output', help='optional .csv or .json file to save the results to')
+    parser.add_argument('--imports', action='store_true',
+                        help='only check the import time of each compute module against its budget')
+    args = parser.parse_args()
+
+    if args.imports:
+        imports_df = time_imports()
+        print(imports_df.to_string(index=False))
+        sys.exit(0 if imports_df['ok'].all() else 1)
+
+    results_df = run_benchmark(args.symbols, args.bars, args.seed, not args.no_memory)
+
+    print('')
+    print('Benchmark: {} symbols x {} bars'.format(args.symbols, args.bars))
+    print(results_df.to_string(index=False))
+
+    if args.output:
+        if args.output.endswith('.json'):
+            results_df.to_json(args.output, orient='records', indent=2)
+        else:
+            results_df.to_csv(args.output, index=False)
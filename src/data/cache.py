@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains an on-disk cache of the raw daily price dataframes returned by
+    the data vendors.  Each vendor/symbol pair is stored in its own pickle file so repeat
+    runs only need to fetch the bars after the last cached date.
+"""
+
+import os
+import re
+import time
+import threading
+import pandas as pd
+
+class VendorCache(object):
+    ''' This class keeps raw vendor dataframes on disk, keyed by vendor and symbol.  A
+        cached frame younger than ttl seconds is returned as is, an older one is refreshed
+        by fetching only the bars after its last date and merging them in.  The modification
+        time of a file is when it was fetched and its access time is when it was last used,
+        so when the files grow past max_bytes the least recently used ones are evicted.
+
+        Args: cache_dir - folder to keep the cache files in
+              ttl - seconds a cached frame is used without refreshing
+              max_bytes - max total size of the cache files, None for no limit
+    '''
+    def __init__(self, cache_dir='vendor_cache', ttl=12 * 60 * 60, max_bytes=500 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, vendor, symbol):
+        ''' Return the cache file path for a vendor/symbol pair '''
+        key = re.sub(r'[^A-Za-z0-9_.-]', '_', '{}_{}'.format(vendor, symbol))
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def load(self, vendor, symbol):
+        ''' Return the cached dataframe and its age in seconds and mark it as used, or
+            (None, None) if missing.  A file that cannot be read back (ex. truncated or
+            corrupt) is removed, so the next get fetches the full history again.
+        '''
+        path = self.path(vendor, symbol)
+        try:
+            mtime = os.path.getmtime(path)
+            df = pd.read_pickle(path)
+            # Keep the fetch time for the ttl, only the access time records the use
+            os.utime(path, (time.time(), mtime))
+        except OSError:
+            return None, None
+        except Exception:
+            # A bad pickle can raise UnpicklingError, EOFError or most other errors
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+
+        return df, time.time() - mtime
+
+    def store(self, vendor, symbol, df):
+        ''' Write a dataframe to the cache and evict old files if over max_bytes '''
+        path = self.path(vendor, symbol)
+
+        # Write to a temp file first so readers never see a partial file
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+
+        self.evict()
+
+    def evict(self):
+        ''' Remove the least recently used files until the cache fits in max_bytes '''
+        if self.max_bytes is None:
+            return
+
+        with self.lock:
+            files = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.pkl'):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    files.append((stat.st_atime, stat.st_size, name))
+
+            total = sum(f[1] for f in files)
+            for atime, size, name in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+
+    def get(self, vendor, symbol, fetch, fetch_since=None):
+        ''' This function returns the dataframe for a vendor/symbol pair, using the cache
+            where possible.
+
+            Args: vendor - name or id of the data vendor
+                  symbol - product symbol
+                  fetch - function of no arguments returning the full history
+                  fetch_since - function of the last cached date returning the bars from
+                                that date on, None to always refetch the full history
+
+            Return: df - dataframe of raw daily price info for symbol
+        '''
+        cached, age = self.load(vendor, symbol)
+
+        # Use the cached frame while it is fresh
+        if cached is not None and age < self.ttl:
+            return cached
+
+        # Fetch only the new bars and merge, newer values replace revised bars
+        if cached is not None and len(cached) and fetch_since is not None:
+            new = fetch_since(cached.index[-1])
+            df = pd.concat([cached, new])
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+        else:
+            df = fetch()
+
+        self.store(vendor, symbol, df)
+
+        return df
+
+    def clear(self):
+        ''' Remove every file from the cache '''
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the cleaning stage for the whole universe of products at once.
+    The closes and volumes of every product are laid end to end in one array, and the
+    start-date trim, low volume floor and outlier flags are computed for all products with
+    segment reductions over that array instead of a Python pass per product and per bar.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Columns of the flags dataframe of each product
+FLAG_COLUMNS = ['low_volume', 'outlier']
+
+def segment_starts(lengths):
+    ''' This function takes in an array of segment lengths and returns the index of the first
+        element of each segment in the concatenated array.
+    '''
+    return np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+def segment_mean_std(values, starts, lengths):
+    ''' This function takes in a concatenated array of values and the starts and lengths of
+        its (non-empty) segments, and returns the mean and sample standard deviation of each
+        segment, skipping NaN.  Each segment is summed on its own like Series.mean and
+        Series.std, so the results match pandas for each product.
+
+        Args: values - 1-D numpy array of every segment end to end
+              starts - int array of segment starts
+              lengths - int array of segment lengths
+
+        Return: mean - array of segment means
+                std - array of segment sample standard deviations
+    '''
+    valid = ~np.isnan(values)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.add.reduceat(np.where(valid, values, 0.0), starts) / counts
+
+        # Sum of squared deviations from each segment's own mean
+        dev = values - np.repeat(mean, lengths)
+        sq = np.where(valid, dev * dev, 0.0)
+        std = np.sqrt(np.add.reduceat(sq, starts) / (counts - 1))
+
+    return mean, np.where(counts > 1, std, np.nan)
+
+def segment_rolling_mean_std(values, starts, lengths, window):
+    ''' This function takes in a concatenated array of values, the starts and lengths of its
+        segments and a window length, and returns the mean and sample standard deviation of
+        the window bars ending at each bar of its own segment, NaN until the window is full.
+        Only past and current bars are used, so there is no lookahead.  NaN values are
+        skipped like in segment_mean_std, so a window with a NaN uses its other bars and
+        gives NaN only with fewer than two of them, and never affects other segments.
+
+        Args: values - 1-D numpy array of every segment end to end
+              starts - int array of segment starts
+              lengths - int array of segment lengths
+              window - number of bars in each window
+
+        Return: mean - array of rolling means
+                std - array of rolling sample standard deviations
+    '''
+    valid = ~np.isnan(values)
+
+    # Center each segment on its first valid value to keep the running sums accurate
+    first = first_above(valid.astype(np.int8), starts, lengths, 0)
+    seg_center = np.where(first < lengths, values[np.minimum(starts + first, len(values) - 1)], 0.0)
+    center = np.repeat(seg_center, lengths)
+    centered = np.where(valid, values - center, 0.0)
+
+    # Running sums of the valid values and of the number of valid bars
+    cs = np.concatenate([[0.0], np.cumsum(centered)])
+    cs2 = np.concatenate([[0.0], np.cumsum(centered * centered)])
+    cn = np.concatenate([[0], np.cumsum(valid)])
+
+    mean = np.full(len(values), np.nan)
+    std = np.full(len(values), np.nan)
+
+    # Bars with a full window inside their own segment
+    pos = np.arange(len(values)) - np.repeat(starts, lengths)
+    full = np.flatnonzero(pos >= window - 1)
+    if len(full) and window > 1:
+        s = cs[full + 1] - cs[full + 1 - window]
+        s2 = cs2[full + 1] - cs2[full + 1 - window]
+        n = cn[full + 1] - cn[full + 1 - window]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean[full] = np.where(n > 0, s / n + center[full], np.nan)
+            std[full] = np.where(n > 1, np.sqrt(np.maximum((s2 - s * s / n) / (n - 1), 0.0)), np.nan)
+
+    return mean, std
+
+def first_above(values, starts, lengths, thresh):
+    ''' This function takes in a concatenated array of values and the starts and lengths of
+        its segments, and returns the position within each segment of the first value above
+        thresh, or the segment length if there is none.
+    '''
+    above = np.flatnonzero(values > thresh)
+    ends = starts + lengths
+
+    # First value above thresh at or after each segment start, if it is inside the segment
+    idx = np.searchsorted(above, starts)
+    candidate = above[np.minimum(idx, len(above) - 1)] if len(above) else ends
+    first = np.where((idx < len(above)) & (candidate < ends), candidate - starts, lengths)
+
+    return first
+
+def clean_universe(product_dict, df_dict, volume_thresh=1000000, low_vol_stds=2.0, outlier_stds=3.0,
+                   window=None):
+    ''' This function takes in a dict of product symbols mapped to info and a dict of raw
+        dataframes, and cleans every product in one batch.  Cryptocurrencies (data_id 1) are
+        trimmed to start at the first bar with volume above volume_thresh like
+        clean_df_crypto, volumes more than low_vol_stds below the mean are replaced with the
+        mean like replace_low_vol, and closes more than outlier_stds from the mean are flagged
+        like check_outliers, without any plots.  A cryptocurrency that never reaches
+        volume_thresh is left out and reported in errors, and the rest are still cleaned.
+
+        With window set, the means and standard deviations come from the trailing window bars
+        of each product instead of its whole history, so no bar is cleaned or flagged with
+        information from after it.  Bars before the first full window are left as is.
+
+        Args: product_dict - a dict of symbols for products with maps to a list of info
+              df_dict - a dictionary of symbols mapped to raw dataframes
+              volume_thresh - min volume to reach before using crypto data
+              low_vol_stds - number of stds below the mean volume to replace at
+              outlier_stds - number of stds from the mean close to flag at
+              window - optional number of trailing bars for the rolling variant
+
+        Return: cleaned - a dictionary of symbols mapped to cleaned dataframes
+                flags - a dictionary of symbols mapped to dataframes of FLAG_COLUMNS boolean
+                        masks on the cleaned dates
+                report - dataframe of product, bars, trimmed, low_volume and outliers counts
+                errors - a dictionary of symbols left out mapped to the exception for each
+    '''
+    products = [p for p in df_dict if len(df_dict[p])]
+    frames = [df_dict[p] for p in products]
+    cleaned, flags, report, errors = {}, {}, [], {}
+
+    if products:
+        lengths = np.array([len(df) for df in frames], dtype=np.int64)
+        starts = segment_starts(lengths)
+        volume = np.concatenate([df['volume'].to_numpy(dtype=np.float64) for df in frames])
+
+        # Trim crypto products to the first bar above the volume threshold
+        crypto = np.array([product_dict[p][0] == 1 for p in products])
+        first = np.where(crypto, first_above(volume, starts, lengths, volume_thresh), 0)
+
+        # Leave out crypto products that never reach it, like clean_df_crypto raising for them
+        dead = crypto & (first == lengths)
+        if dead.any():
+            for prod in np.array(products, dtype=object)[dead]:
+                errors[prod] = IndexError('No volume above {}'.format(volume_thresh))
+            volume = volume[np.repeat(~dead, lengths)]
+            products = [p for p, d in zip(products, dead) if not d]
+            frames = [df for df, d in zip(frames, dead) if not d]
+            lengths, first = lengths[~dead], first[~dead]
+            starts = segment_starts(lengths)
+
+    if products:
+        keep = (np.arange(len(volume)) - np.repeat(starts, lengths)) >= np.repeat(first, lengths)
+        new_lengths = lengths - first
+        new_starts = segment_starts(new_lengths)
+        volume = volume[keep]
+        close = np.concatenate([df['close'].to_numpy(dtype=np.float64) for df in frames])[keep]
+
+        # Means and stds of every product, over the whole history or trailing windows
+        if window is None:
+            vol_mean, vol_std = segment_mean_std(volume, new_starts, new_lengths)
+            close_mean, close_std = segment_mean_std(close, new_starts, new_lengths)
+            vol_mean, vol_std = np.repeat(vol_mean, new_lengths), np.repeat(vol_std, new_lengths)
+            close_mean, close_std = np.repeat(close_mean, new_lengths), np.repeat(close_std, new_lengths)
+        else:
+            vol_mean, vol_std = segment_rolling_mean_std(volume, new_starts, new_lengths, window)
+            close_mean, close_std = segment_rolling_mean_std(close, new_starts, new_lengths, window)
+
+        # Flag and replace low volumes, flag outlier closes
+        low_volume = volume < (vol_mean - (low_vol_stds * vol_std))
+        volume = np.where(low_volume, vol_mean, volume)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            outlier = (np.abs(close - close_mean) / close_std) > outlier_stds
+
+        # Split the batch back into products
+        for i, (prod, df) in enumerate(zip(products, frames)):
+            lo, hi = new_starts[i], new_starts[i] + new_lengths[i]
+            out = df.iloc[first[i]:].copy()
+            out['volume'] = volume[lo:hi]
+            cleaned[prod] = out
+            flags[prod] = pd.DataFrame({'low_volume': low_volume[lo:hi], 'outlier': outlier[lo:hi]},
+                                       index=out.index, columns=FLAG_COLUMNS)
+            report.append([prod, int(new_lengths[i]), int(first[i]), int(low_volume[lo:hi].sum()),
+                           int(outlier[lo:hi].sum())])
+
+    # Keep products without any bars as they are
+    for prod in df_dict:
+        if prod not in cleaned and prod not in errors:
+            cleaned[prod] = df_dict[prod].copy()
+            flags[prod] = pd.DataFrame(columns=FLAG_COLUMNS, index=df_dict[prod].index, dtype=bool)
+            report.append([prod, 0, 0, 0, 0])
+
+    order = [prod for prod in df_dict if prod not in errors]
+    cleaned = {prod: cleaned[prod] for prod in order}
+    flags = {prod: flags[prod] for prod in order}
+    report = pd.DataFrame(report, columns=['product', 'bars', 'trimmed', 'low_volume', 'outliers'])
+
+    return cleaned, flags, report.set_index('product').loc[order].reset_index(), errors
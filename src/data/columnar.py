@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains a columnar store for daily price and indicator dataframes.  Each
+    symbol gets a folder with one raw binary file per column plus a small json manifest,
+    so full columns and date ranges can be memory-mapped straight into numpy arrays and
+    new bars can be appended without rewriting the history.  It is a standalone utility, the
+    pipeline itself keeps its data in the SQLite3 database.
+"""
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+class ColumnStore(object):
+    ''' This class stores a dataframe per symbol as memory-mapped numpy column files.  The
+        date index is kept as a datetime64[ns] column so date ranges are found with a binary
+        search.  Only numeric and boolean columns are supported.
+
+        Args: root - folder to keep the store in
+    '''
+    index_file = 'date.bin'
+    manifest_file = 'manifest.json'
+
+    def __init__(self, root='column_store'):
+        self.root = root
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def folder(self, symbol):
+        ''' Return the folder for a symbol.  A symbol with characters that are not safe in a
+            folder name gets them replaced and a hash of the symbol added, so ex. 'BTC/USD'
+            and 'BTC_USD' never share a folder.
+        '''
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', symbol)
+        if name != symbol:
+            name += '-' + hashlib.sha1(symbol.encode()).hexdigest()[:10]
+        return os.path.join(self.root, name)
+
+    def column_file(self, name):
+        ''' Return the file name for a column '''
+        return 'col_' + re.sub(r'[^A-Za-z0-9_.-]', '_', name) + '.bin'
+
+    def symbols(self):
+        ''' Return a list of all symbols in the store, as they were written '''
+        symbols = []
+        for name in os.listdir(self.root):
+            try:
+                with open(os.path.join(self.root, name, self.manifest_file)) as f:
+                    symbols.append(json.load(f).get('symbol', name))
+            except (OSError, ValueError):
+                continue
+
+        return sorted(symbols)
+
+    def manifest(self, symbol):
+        ''' Return the manifest of a symbol, None if it is not in the store '''
+        try:
+            with open(os.path.join(self.folder(symbol), self.manifest_file)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, symbol, manifest):
+        ''' Write the manifest of a symbol, replacing the old one in a single step '''
+        path = os.path.join(self.folder(symbol), self.manifest_file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def column_arrays(self, df):
+        ''' Return the date array and a dict of column name to numpy array for a dataframe '''
+        dates = pd.to_datetime(df.index).to_numpy(dtype='datetime64[ns]')
+
+        arrays = {}
+        for col in df.columns:
+            values = df[col].to_numpy()
+            if values.dtype.kind not in 'biuf':
+                raise ValueError('Column {} has unsupported dtype {}'.format(col, values.dtype))
+            arrays[col] = values
+
+        return dates, arrays
+
+    def write(self, symbol, df):
+        ''' This function takes in a symbol and a dataframe with a date index and writes it to
+            the store, replacing anything stored for the symbol before.
+
+            Args: symbol - product symbol
+                  df - dataframe of price and indicator information
+
+            Return: None - writes the columns and manifest for the symbol
+        '''
+        folder = self.folder(symbol)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        dates, arrays = self.column_arrays(df)
+
+        # Write each column as a raw binary file
+        dates.tofile(os.path.join(folder, self.index_file))
+        for col, values in arrays.items():
+            values.tofile(os.path.join(folder, self.column_file(col)))
+
+        self.write_manifest(symbol, {'symbol': symbol,
+                                     'rows': len(df),
+                                     'index_name': df.index.name,
+                                     'columns': [[col, values.dtype.str] for col, values in arrays.items()]})
+
+    def append(self, symbol, df):
+        ''' This function takes in a symbol and a dataframe of new bars and appends the bars
+            after the last stored date to the end of each column file.  The new bars must have
+            the same columns as the stored data.  A symbol not in the store is written.
+
+            Args: symbol - product symbol
+                  df - dataframe of new price and indicator information
+
+            Return: count - number of rows appended
+        '''
+        manifest = self.manifest(symbol)
+        if manifest is None:
+            self.write(symbol, df)
+            return len(df)
+
+        # Keep only bars after the last stored date
+        if manifest['rows']:
+            last = self.load_index(symbol, manifest)[-1]
+            df = df[pd.to_datetime(df.index) > last]
+        if not len(df):
+            return 0
+
+        columns = [col for col, dtype in manifest['columns']]
+        if list(df.columns) != columns:
+            raise ValueError('Columns of new bars do not match the stored columns for {}'.format(symbol))
+
+        dates, arrays = self.column_arrays(df)
+        rows = manifest['rows']
+        folder = self.folder(symbol)
+
+        # Write each column from the end of the rows in the manifest, dropping anything
+        # left over from an append that did not finish
+        files = [(self.index_file, dates)] + [(self.column_file(col), arrays[col].astype(dtype))
+                                              for col, dtype in manifest['columns']]
+        for name, values in files:
+            with open(os.path.join(folder, name), 'r+b') as f:
+                f.truncate(rows * values.dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                values.tofile(f)
+
+        manifest['rows'] = rows + len(df)
+        self.write_manifest(symbol, manifest)
+
+        return len(df)
+
+    def memmap(self, symbol, name, dtype, rows):
+        ''' Return a read-only memory map of a column file, or an empty array for no rows '''
+        if not rows:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.folder(symbol), name), dtype=dtype, mode='r', shape=(rows,))
+
+    def load_index(self, symbol, manifest=None):
+        ''' Return the memory-mapped datetime64[ns] dates of a symbol '''
+        manifest = manifest or self.manifest(symbol)
+        return self.memmap(symbol, self.index_file, 'datetime64[ns]', manifest['rows'])
+
+    def load(self, symbol, columns=None, start=None, end=None):
+        ''' This function takes in a symbol and returns its dataframe from the store, with
+            optional column selection and date range.
+
+            Args: symbol - product symbol
+                  columns - list of columns to load, None for all
+                  start - first date to include, None for the first stored date
+                  end - last date to include, None for the last stored date
+
+            Return: df - dataframe with a DatetimeIndex of the selected rows and columns
+        '''
+        manifest = self.manifest(symbol)
+        if manifest is None:
+            raise KeyError(symbol)
+
+        # Find the row range with a binary search on the dates
+        dates = self.load_index(symbol, manifest)
+        lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), side='right')
+
+        dtypes = dict(manifest['columns'])
+        if columns is None:
+            columns = [col for col, dtype in manifest['columns']]
+
+        # Copy only the selected slice of each column out of the memory maps
+        data = {col: np.array(self.memmap(symbol, self.column_file(col), dtypes[col], manifest['rows'])[lo:hi])
+                for col in columns}
+        index = pd.DatetimeIndex(np.array(dates[lo:hi]), name=manifest['index_name'])
+
+        return pd.DataFrame(data, index=index, columns=columns)
+
+    def load_all(self, symbols=None, columns=None, start=None, end=None):
+        ''' This function returns a dict of symbols mapped to dataframes loaded with load.
+
+            Args: symbols - list of symbols to load, None for every symbol in the store
+                  columns - list of columns to load, None for all
+                  start - first date to include
+                  end - last date to include
+
+            Return: df_dict - a dictionary of symbols mapped to dataframes
+        '''
+        if symbols is None:
+            symbols = self.symbols()
+
+        return {symbol: self.load(symbol, columns, start, end) for symbol in symbols}
+
+    def write_all(self, df_dict):
+        ''' This function writes every dataframe of a dict of symbols mapped to dataframes '''
+        for symbol, df in df_dict.items():
+            self.write(symbol, df)
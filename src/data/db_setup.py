@@ -3,11 +3,46 @@
 
 """" This module contains all the code for initial setup of the sqlite3 database to
     keep all data vendor, product, and price information.  It creates three separate
-    tables and links them using table specific ids.
+    tables and links them using table specific ids.  The layout is versioned with the
+    sqlite user_version pragma, so running db_setup on an existing database is safe and
+    upgrades an older layout in place.
 """
 
 import sqlite3
 
+# Version of the table layout created by db_setup
+SCHEMA_VERSION = 2
+
+# Data vendors
+DATA_ROWS = [(1, 'Cryptocompare', 'https://min-api.cryptocompare.com'),
+             (2, 'Quandl', 'https://docs.quandl.com'),
+             (3, 'Quantopian', 'https://www.quantopian.com/data')]
+
+# Tables of the current layout.  Daily_Prices is keyed on (symbol, date), with dates
+# stored as integer epoch seconds, so lookups by symbol and date range use the key and
+# re-inserting a bar replaces it instead of adding a duplicate.
+CREATE_TABLES = ['CREATE TABLE IF NOT EXISTS Data (id INTEGER PRIMARY KEY, name TEXT, url TEXT)',
+
+                 'CREATE TABLE IF NOT EXISTS Symbols (id INTEGER PRIMARY KEY,\
+                                                      data_id INTEGER,\
+                                                      symbol TEXT NOT NULL UNIQUE,\
+                                                      name TEXT,\
+                                                      sector TEXT,\
+                                                      exchange TEXT,\
+                                                      FOREIGN KEY (data_id) REFERENCES Data (id))',
+
+                 'CREATE TABLE IF NOT EXISTS Daily_Prices (data_id INTEGER,\
+                                                           symbol TEXT NOT NULL,\
+                                                           date INTEGER NOT NULL,\
+                                                           open REAL,\
+                                                           high REAL,\
+                                                           low REAL,\
+                                                           close REAL,\
+                                                           volume REAL,\
+                                                           PRIMARY KEY (symbol, date),\
+                                                           FOREIGN KEY (symbol) REFERENCES Symbols (symbol))\
+                                                           WITHOUT ROWID']
+
 def connect(sqlite_file):
     ''' This function takes in a sqlite db files, returns a connection
         and a cursor.
@@ -32,129 +67,86 @@ def close(conn):
     conn.commit()
     conn.close()
 
-def db_setup(filename):
-    # DATA TABLE
-    # Initialize variables for file name, table, columns, data types
-    sqlite_file = filename
-    table_name = 'Data'
-    id_col = 'id'
-    name_col = 'name'
-    url_col = 'url'
-    dtype_int = 'INTEGER'
-    dtype_text = 'TEXT'
-
-    # Connect to the database file
-    conn = sqlite3.connect(sqlite_file)
-    c = conn.cursor()
-
-    # Create a new table with 3 columns
-    c.execute('CREATE TABLE {tn} ({ic} {dti} PRIMARY KEY, {nc} {dtt}, {uc} {dtt})'\
-         .format(tn=table_name, ic=id_col, dti=dtype_int, nc=name_col, dtt=dtype_text, uc=url_col))
-
-    # Commit changes and close
-    conn.commit()
-    conn.close()
-
-    # Add value for Cryptocompare to Data table
-    conn, c = connect(sqlite_file)
-
-    c.execute("INSERT INTO {tn} ({ic}, {nc}, {uc}) VALUES (1, 'Cryptocompare', 'https://min-api.cryptocompare.com')"\
-          .format(tn=table_name, ic=id_col, nc=name_col, uc=url_col))
-
-    close(conn)
-
-    # Add value for Quandl to Data table
-    conn, c = connect(sqlite_file)
-
-    c.execute("INSERT INTO {tn} ({ic}, {nc}, {uc}) VALUES (2, 'Quandl', 'https://docs.quandl.com')"\
-          .format(tn=table_name, ic=id_col, nc=name_col, uc=url_col))
-
-    close(conn)
+def table_exists(c, table_name):
+    ''' Return True if the database of cursor c has a table named table_name '''
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    return c.fetchone() is not None
 
-    # Add value for Quantopian to Data table
-    conn, c = connect(sqlite_file)
-
-    c.execute("INSERT INTO {tn} ({ic}, {nc}, {uc}) VALUES (3, 'Quantopian', 'https://www.quantopian.com/data')"\
-          .format(tn=table_name, ic=id_col, nc=name_col, uc=url_col))
-
-    close(conn)
+def schema_version(c):
+    ''' This function takes in a cursor and returns the version of the table layout of its
+        database, 0 for an empty database and 1 for the original layout that was created
+        before versioning (TEXT dates and no key on symbol and date).
+    '''
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0 and table_exists(c, 'Daily_Prices'):
+        version = 1
 
-    # SYMBOLS TABLE
-    # Create table for symbol
-    # Initialize variables for file name, table, columns, data types
-    table_name = 'Symbols'
+    return version
 
-    data_table = 'Data'
-    data_id = 'id'
+def migrate_1_to_2(c):
+    ''' This function moves a database from the original layout to version 2.  Symbols get a
+        unique symbol column and Daily_Prices is rebuilt with integer epoch dates and a
+        (symbol, date) primary key.  Duplicate bars from re-running the original inserts are
+        collapsed, keeping the last one inserted.
 
-    id_col = 'id'
-    data_id_col = 'data_id'
-    symbol_col = 'symbol'
-    name_col = 'name'
-    sector_col = 'sector'
-    exchange_col = 'exchange'
-    dtype_int = 'INTEGER'
-    dtype_text = 'TEXT'
+        Args: c - cursor in the database
 
-    # Connect to the database file
-    conn = sqlite3.connect(sqlite_file)
-    c = conn.cursor()
+        Return: None - rebuilds the Symbols and Daily_Prices tables
+    '''
+    c.execute('ALTER TABLE Symbols RENAME TO Symbols_v1')
+    c.execute('ALTER TABLE Daily_Prices RENAME TO Daily_Prices_v1')
+    for sql in CREATE_TABLES:
+        c.execute(sql)
+
+    # Keep the last row of each symbol, and of each symbol and date
+    c.execute('INSERT INTO Symbols (id, data_id, symbol, name, sector, exchange)\
+               SELECT id, data_id, symbol, name, sector, exchange FROM Symbols_v1\
+               WHERE id IN (SELECT MAX(id) FROM Symbols_v1 GROUP BY symbol)')
+    c.execute("INSERT INTO Daily_Prices (data_id, symbol, date, open, high, low, close, volume)\
+               SELECT data_id, symbol, CAST(strftime('%s', date) AS INTEGER), open, high, low, close, volume\
+               FROM Daily_Prices_v1\
+               WHERE id IN (SELECT MAX(id) FROM Daily_Prices_v1 GROUP BY symbol, date)")
+
+    c.execute('DROP TABLE Symbols_v1')
+    c.execute('DROP TABLE Daily_Prices_v1')
+
+# Functions that move a database from version i to version i + 1
+MIGRATIONS = {1: migrate_1_to_2}
 
-    # Create a new table with 3 columns
-    c.execute('CREATE TABLE {tn} ({ic} {dti} PRIMARY KEY,\
-                              {dc} {dti},\
-                              {sc} {dtt},\
-                              {nc} {dtt},\
-                              {sec} {dtt},\
-                              {ec} {dtt},\
-                              FOREIGN KEY ({dc}) REFERENCES {dt} ({dic}))'\
-         .format(tn=table_name, ic=id_col, dti=dtype_int, dc=data_id_col, sc=symbol_col,\
-                 dtt=dtype_text, nc=name_col, sec=sector_col, ec=exchange_col,\
-                 dt=data_table, dic=data_id))
-
-    # Commit changes and close
-    conn.commit()
-    conn.close()
+def db_setup(filename):
+    ''' This function takes in a sqlite db file and makes sure it has every table of the
+        current layout.  A new file gets all tables created, a database with an older layout
+        is migrated one version at a time, and a current database is left as is, so it can be
+        run before every load.  All changes are made in one transaction.
 
-    # DAILY_PRICES TABLE
-    # Create table for daily_price
-    # Initialize variables for file name, table, columns, data types
-    table_name = 'Daily_Prices'
-    symbols_table = 'Symbols'
-
-    id_col = 'id'
-    data_id_col = 'data_id'
-    symbol_col = 'symbol'
-    date_col = 'date'
-    open_col = 'open'
-    high_col = 'high'
-    low_col = 'low'
-    close_col = 'close'
-    volume_col = 'volume'
-
-    dtype_int = 'INTEGER'
-    dtype_text = 'TEXT'
-    dtype_real = 'REAL'
-
-    # Connect to the database file
-    conn = sqlite3.connect(sqlite_file)
-    c = conn.cursor()
+        Args: filename - a sqlite db file name
 
-    # Create a new table with 3 columns
-    c.execute('CREATE TABLE {tn} ({ic} {dti} PRIMARY KEY,\
-                              {dc} {dti},\
-                              {sc} {dtt},\
-                              {dtc} {dtt},\
-                              {oc} {dtr},\
-                              {hc} {dtr},\
-                              {lc} {dtr},\
-                              {cc} {dtr},\
-                              {vc} {dti},\
-                              FOREIGN KEY ({sc}) REFERENCES {st} ({sc}))'\
-         .format(tn=table_name, ic=id_col, dti=dtype_int, dc=data_id_col, sc=symbol_col,\
-                 dtt=dtype_text, dtc=date_col, oc=open_col, dtr=dtype_real, hc=high_col,\
-                 lc=low_col, cc=close_col, vc=volume_col, st=symbols_table))
-
-    # Commit changes and close
-    conn.commit()
-    conn.close()
+        Return: version - version of the table layout, SCHEMA_VERSION
+    '''
+    conn, c = connect(filename)
+
+    try:
+        c.execute('BEGIN')
+        version = schema_version(c)
+        if version > SCHEMA_VERSION:
+            raise ValueError('Database {} has schema version {}, newer than {}'.format(
+                filename, version, SCHEMA_VERSION))
+
+        # Upgrade an older layout, or create every table of a new database
+        while 0 < version < SCHEMA_VERSION:
+            MIGRATIONS[version](c)
+            version += 1
+        for sql in CREATE_TABLES:
+            c.execute(sql)
+
+        # Add the data vendors that are not there yet
+        c.executemany('INSERT OR IGNORE INTO Data (id, name, url) VALUES (?, ?, ?)', DATA_ROWS)
+
+        c.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        close(conn)
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+
+    return SCHEMA_VERSION
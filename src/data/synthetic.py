@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains functions that generate deterministic synthetic daily price data
+    in the same format as the vendor dataframes, so every stage of the pipeline can be run
+    and timed without network access.
+"""
+
+import numpy as np
+import pandas as pd
+
+def create_df_synthetic(n_bars, seed=0, start='2000-01-03', freq='B', start_price=100.0,
+                        daily_vol=0.015, mean_volume=5000000):
+    ''' This function takes in a number of bars and a seed and returns a dataframe of random
+        walk daily price info with the same columns as create_df_crypto and create_df_quandl.
+        The same arguments always give the same dataframe.
+
+        Args: n_bars - number of daily bars to generate
+              seed - seed for the random number generator
+              start - first date of the data
+              freq - pandas frequency of the dates (default business days)
+              start_price - price of the first bar
+              daily_vol - standard deviation of the daily log returns
+              mean_volume - average daily volume
+
+        Return: df - dataframe of daily price info with a 'Date' index
+    '''
+    rng = np.random.RandomState(seed)
+
+    # Random walk of closing prices, each open near the previous close
+    log_returns = rng.normal(0.0, daily_vol, n_bars)
+    close = start_price * np.exp(np.cumsum(log_returns))
+    prev_close = np.concatenate([[start_price], close[:-1]])
+    open_ = prev_close * np.exp(rng.normal(0.0, daily_vol / 4, n_bars))
+
+    # Highs and lows extend past the open and close by a random fraction of the daily vol
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0.0, daily_vol / 2, n_bars)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0.0, daily_vol / 2, n_bars)))
+
+    # Lognormal volume with occasional spikes
+    volume = mean_volume * rng.lognormal(0.0, 0.5, n_bars)
+    volume *= np.where(rng.rand(n_bars) < 0.02, 3.0, 1.0)
+
+    df = pd.DataFrame({'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume},
+                      index=pd.date_range(start, periods=n_bars, freq=freq, name='Date'),
+                      columns=['open', 'high', 'low', 'close', 'volume'])
+
+    return df
+
+def synthetic_products(n_symbols):
+    ''' This function takes in a number of symbols and returns a product dict in the same
+        format as the products dict of the main program, alternating between the
+        Cryptocompare (1) and Quandl (2) data ids.
+
+        Args: n_symbols - number of symbols
+
+        Return: product_dict - dict of symbols mapped to [data_id, name, sector, exchange]
+    '''
+    product_dict = {}
+    for i in range(n_symbols):
+        data_id = 1 if i % 2 else 2
+        product_dict['SYN{:04d}'.format(i)] = [data_id, 'Synthetic{}'.format(i), 'Synthetic',
+                                               'CCAgg' if data_id == 1 else 'CME']
+
+    return product_dict
+
+def generate_synthetic_df_dict(product_dict, n_bars, seed=0):
+    ''' This function takes in a product dict and a number of bars and returns a dict of
+        symbols mapped to raw synthetic dataframes, seeded per symbol.  Like the vendor
+        data, Cryptocompare (1) products trade every day and are indexed by datetime.date
+        objects as in create_df_crypto, and the rest trade on business days with a
+        DatetimeIndex as in create_df_quandl.
+
+        Args: product_dict - a dict of symbols for products with maps to a list of info
+              n_bars - number of daily bars per symbol
+              seed - base seed, symbol i uses seed + i
+
+        Return: df_dict - a dictionary of symbols mapped to dataframes of raw price info
+    '''
+    df_dict = {}
+    for i, (symbol, info) in enumerate(product_dict.items()):
+        if info[0] == 1:
+            df = create_df_synthetic(n_bars, seed + i, freq='D')
+            df.index = pd.Index(df.index.date, name='Date')
+        else:
+            df = create_df_synthetic(n_bars, seed + i)
+        df_dict[symbol] = df
+
+    return df_dict
@@ -8,16 +8,23 @@
     a SQLite3 database.
 """
 
-import requests
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import json
 import datetime
-import quandl
+from visualization.figures import show_or_save
+from data.cleaning import clean_universe
+from instrumentation.instrumentation import PROFILER
+import os
 import sqlite3
-
-def create_df_crypto(symbol, curr='USD', limit=2000):
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.request import pathname2url
+
+def create_df_crypto(symbol, curr='USD', limit=2000, url='https://min-api.cryptocompare.com/data/histoday',
+                     timeout=30):
     ''' This function takes in a symbol of a cryptocurrency to be
         used with the Cryptocompare API, and returns a formatted dataframe
         for later processing.
@@ -25,15 +32,19 @@ def create_df_crypto(symbol, curr='USD', limit=2000):
         Args: symbol - cryptocurrency symbol
               curr - currency to report in (default USD)
               limit - max number of data points (default 2500)
+              url - histoday endpoint, can point at a local server for testing
+              timeout - seconds to wait for the response
 
         Return: df - dataframe of daily price info for symbol
     '''
-    # Set url and params for the call to Cryptocompare API
-    url = 'https://min-api.cryptocompare.com/data/histoday'
+    import requests
+
+    # Set params for the call to Cryptocompare API
     params = {'fsym': symbol, 'tsym': curr, 'limit': limit}
 
     # Call API for symbol and put data into pandas dataframe
-    response = requests.get(url, params=params)
+    response = requests.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
     data = response.json()['Data']
     df = pd.DataFrame(data)
 
@@ -47,18 +58,21 @@ def create_df_crypto(symbol, curr='USD', limit=2000):
 
     return df
 
-def create_df_quandl(symbol, api_key):
+def create_df_quandl(symbol, api_key, start_date=None):
     ''' This function takes in a symbol of a futures contract to be used
         with the Quandl API as well as the API key, and returns a formatted
         dataframe for processing.
 
         Args: symbol - a symbol for a continuous futures contract
               api_key - Quandl API key
+              start_date - optional first date to fetch, None for the full history
 
         Return: df - dataframe for daily price info for symbol
     '''
+    import quandl
+
     # Quandl API call which puts price data into dataframe
-    df = quandl.get('SCF/CME_{s}1_FW'.format(s=symbol), authtoken=api_key)
+    df = quandl.get('SCF/CME_{s}1_FW'.format(s=symbol), authtoken=api_key, start_date=start_date)
 
     # Drop open interest column and rename Settle column
     df.drop(['Prev. Day Open Interest'], axis=1, inplace=True)
@@ -79,9 +93,11 @@ def clean_df_crypto(df, volume_thresh=1000000):
 
         Return df - the filtered dataframe with only points after the volume threshold is hit
     '''
-    # Find start_date and filter df
-    start_date = df.index[df.volume > volume_thresh].tolist()[0]
-    df = df[start_date:]
+    # Find the first bar over the threshold and filter df
+    above = df['volume'].to_numpy() > volume_thresh
+    if not above.any():
+        raise IndexError('No volume above {}'.format(volume_thresh))
+    df = df.iloc[above.argmax():]
 
     return df
 
@@ -105,29 +121,49 @@ def replace_low_vol(df):
     mean_vol = df.volume.mean()
     std_vol = df.volume.std()
 
-    # Apply lambda function to transform poor data
-    df['volume'] = df['volume'].apply(lambda x: Replace(x, mean_vol, std_vol))
+    # Replace poor data with the mean for the whole column at once, same as Replace
+    df['volume'] = df['volume'].mask(df['volume'] < (mean_vol - (2 * std_vol)), mean_vol)
 
     return df
 
-def check_outliers(df):
+def check_outliers(df, save_path=None):
     ''' This function finds all closing price points that are more than 3 stds away from
         the mean and plots them on a line graph of all the data.  This can be used to see
         if these points are truly outliers.
 
         Args: df - dataframe to be checked for outliers
+              save_path - optional file to write the graph to instead of showing it
 
         Return: None - shows a graph of the price data series with annotations for outliers
     '''
     # Use a copy of the dataframe
     cpy = df.copy()
     # Create range of values that are more than 3 stds away from mean
-    cpy['stds_from_mean'] = ((cpy['close'] - cpy['close'].mean()).apply(abs)) / cpy['close'].std()
-    locs_gt_3std = [cpy.index.get_loc(x) for x in cpy.index[cpy['stds_from_mean'] > 3.0]]
+    cpy['stds_from_mean'] = (cpy['close'] - cpy['close'].mean()).abs() / cpy['close'].std()
+    locs_gt_3std = np.flatnonzero(cpy['stds_from_mean'].to_numpy() > 3.0).tolist()
 
     # Plot the price data, highlighting the outliers
+    draw_outliers(cpy.index, cpy.close, locs_gt_3std, save_path)
+
+    # Print out description
+    print('Number of data points: {}'.format(len(cpy.index)))
+    print('Number of outliers: {}'.format(len(locs_gt_3std)))
+
+def draw_outliers(dates, close, locs, save_path=None):
+    ''' This function draws the chart of check_outliers, a line of closing prices with the
+        outliers at positions locs marked.
+
+        Args: dates - dates of the closing prices
+              close - closing prices
+              locs - list of positions of the outliers
+              save_path - optional file to write the graph to instead of showing it
+
+        Return: None - plots the closing prices
+    '''
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(14,7))
-    plt.plot(cpy.index, cpy.close, linestyle='solid', markevery=locs_gt_3std,
+    plt.plot(dates, close, linestyle='solid', markevery=locs,
                 marker='o', markerfacecolor='r', label='Outliers')
 
     # Apply title, legend and labels
@@ -137,41 +173,313 @@ def check_outliers(df):
     plt.legend()
     plt.grid()
 
-    plt.show()
+    show_or_save(save_path)
 
-    # Print out description
-    print('Number of data points: {}'.format(len(cpy.index)))
-    print('Number of outliers: {}'.format(len(locs_gt_3std)))
+class RateLimiter(object):
+    ''' This class spaces out calls to a data vendor so that no more than rate calls
+        per second are started, across all threads sharing the limiter.
+
+        Args: rate - max calls per second, None or 0 for no limit
+    '''
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        ''' Block until the next call is allowed to start '''
+        if not self.interval:
+            return
+
+        # Reserve the next slot while holding the lock, then sleep outside of it
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+def create_df_product(product, info, api_key=None, cache=None, clean=True):
+    ''' This function takes in a product symbol, its info list and a Quandl API key and
+        returns the cleaned dataframe of daily price info from the matching data vendor.
+        With a VendorCache, the raw vendor data is read from disk and only the bars after
+        the last cached date are fetched.
+
+        Args: product - product symbol
+              info - list of info for the product, data_id first
+              api_key - Quandl API key
+              cache - optional VendorCache for the raw vendor data
+              clean - False to return the raw vendor data, ex. to clean every product
+                      at once with clean_universe
+
+        Return: df - cleaned dataframe of daily price info for product
+    '''
+    # Set the full and incremental fetches for the data vendor
+    if info[0] == 1:
+        fetch = partial(create_df_crypto, product)
+        fetch_since = (lambda last: create_df_crypto(product, limit=days_since(last) + 1))
+    elif info[0] == 2:
+        fetch = partial(create_df_quandl, product, api_key)
+        fetch_since = (lambda last: create_df_quandl(product, api_key, start_date=last))
+    else:
+        raise ValueError('Unknown data_id {} for {}'.format(info[0], product))
+
+    if cache is None:
+        df = fetch()
+    else:
+        df = cache.get(info[0], product, fetch, fetch_since)
+
+    # Clean the raw vendor data
+    if not clean:
+        return df
+    if info[0] == 1:
+        df = clean_df_crypto(df)
+    df = replace_low_vol(df.copy())
+
+    return df
+
+def days_since(date):
+    ''' This function takes in a date and returns the number of calendar days from it to today '''
+    return max((pd.Timestamp.today().normalize() - pd.Timestamp(date)).days, 0)
+
+def create_df_recorded(create_df, product, info, api_key):
+    ''' This is a helper function that calls create_df for a product and records the
+        fetch as an 'acquire' stage of the PROFILER.
+    '''
+    with PROFILER.stage('acquire', product) as record:
+        df = create_df(product, info, api_key)
+        record['rows'] = len(df)
+
+    return df
+
+def is_transient(error):
+    ''' This function takes in an exception raised by a vendor call and returns True if
+        it is worth retrying: dropped connections, timeouts, rate limits (HTTP 429) and
+        server errors (HTTP 5xx).  Anything else, like a bad vendor id, a parsing error or
+        an HTTP 4xx, fails the same way on every attempt.
+    '''
+    # HTTP errors carry a status, requests on the response and quandl on the error
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        status = getattr(error, 'http_status', None)
+    if status is not None:
+        return status == 429 or status >= 500
+
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import requests
+    except ImportError:
+        return False
+
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+def fetch_with_retry(fetch, retries=3, backoff=1.0, limiter=None, semaphore=None):
+    ''' This function takes in a function with no arguments and calls it, retrying with
+        exponential backoff when it raises a transient error (see is_transient).  Other
+        errors are raised on the first attempt.  The optional limiter and semaphore are
+        held for each attempt to respect vendor rate and concurrency limits.
+
+        Args: fetch - function to call
+              retries - number of retries after the first failed attempt
+              backoff - seconds to wait before the first retry, doubled for each retry
+              limiter - optional RateLimiter for the vendor
+              semaphore - optional semaphore bounding concurrent calls to the vendor
+
+        Return: the result of fetch, the last exception is raised if every attempt fails
+    '''
+    for attempt in range(retries + 1):
+        try:
+            if semaphore is not None:
+                with semaphore:
+                    if limiter is not None:
+                        limiter.wait()
+                    return fetch()
+            if limiter is not None:
+                limiter.wait()
+            return fetch()
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+def acquire_df_dict(product_dict, api_key=None, max_workers=8, vendor_limits={1: 4, 2: 2},
+                    rate_limits={}, retries=3, backoff=1.0, create_df=create_df_product):
+    ''' This function takes in a dict of product symbols mapped to information about the
+        product and fetches every product concurrently on a bounded thread pool.  Each
+        vendor (data_id) gets its own concurrency limit and rate limit, transient failures are
+        retried with backoff, and a symbol that still fails is reported without stopping
+        the other symbols.
+
+        Args: product_dict - a dict of symbols for products with maps to
+                             a list of info
+              api_key - Quandl API key
+              max_workers - max number of threads fetching at once
+              vendor_limits - dict of data_id to max concurrent calls to that vendor
+              rate_limits - dict of data_id to max calls per second to that vendor
+              retries - number of retries for each symbol
+              backoff - seconds to wait before the first retry, doubled for each retry
+              create_df - function of (product, info, api_key) returning a dataframe
+
+        Return: df_dict - a dictionary of symbols mapped to dataframes of price info,
+                          in the same order as product_dict
+                errors - a dictionary of symbols mapped to the exception that failed them
+    '''
+    # Create a semaphore and rate limiter for every vendor
+    vendors = set(info[0] for info in product_dict.values())
+    semaphores = {v: threading.BoundedSemaphore(vendor_limits[v]) for v in vendors if v in vendor_limits}
+    limiters = {v: RateLimiter(rate_limits.get(v)) for v in vendors}
+
+    # Submit every product to the pool
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for product, info in product_dict.items():
+            fetch = partial(create_df_recorded, create_df, product, info, api_key)
+            futures[product] = pool.submit(fetch_with_retry, fetch, retries, backoff,
+                                           limiters[info[0]], semaphores.get(info[0]))
+
+    # Collect results in product order, keeping failures apart
+    df_dict = {}
+    errors = {}
+    for product, future in futures.items():
+        try:
+            df_dict[product] = future.result()
+        except Exception as e:
+            errors[product] = e
+
+    return df_dict, errors
 
-def generate_df_dict(product_dict, api_key=None):
+def generate_df_dict(product_dict, api_key=None, max_workers=8, vendor_limits={1: 4, 2: 2},
+                     rate_limits={}, retries=3, backoff=1.0, cache=None):
     ''' This function takes in a dict of product symbols mapped to
         information about the product  and a Quandl API key and returns
         a dict object with the symbols as keys and a dataframe of price
-        info as values.
+        info as values.  Products are fetched concurrently with acquire_df_dict,
+        and any symbol that fails to be fetched or cleaned is printed and left out
+        of the dict.  The raw data of every product is then cleaned in one batch
+        with clean_universe, and the number of bars trimmed, replaced and flagged
+        is printed.
 
         Args: product_dict - a dict of symbols for products with maps to
                              a list of info
               api_key - Quandl API key
+              max_workers - max number of threads fetching at once, 1 to fetch serially
+              vendor_limits - dict of data_id to max concurrent calls to that vendor
+              rate_limits - dict of data_id to max calls per second to that vendor
+              retries - number of retries for each symbol
+              backoff - seconds to wait before the first retry, doubled for each retry
+              cache - optional VendorCache to read and refresh raw vendor data from
 
         Return: df_dict - a dictionary of symbols mapped to dataframes
                           of price info
     '''
-    df_dict = {}
+    with PROFILER.stage('generate_df_dict') as record:
+        df_dict, errors = acquire_df_dict(product_dict, api_key, max_workers, vendor_limits,
+                                          rate_limits, retries, backoff,
+                                          partial(create_df_product, cache=cache, clean=False))
+        record['rows'] = sum(len(df) for df in df_dict.values())
+
+    # Print out any symbols that could not be acquired
+    for product, error in errors.items():
+        print('Failed to acquire {}: {}'.format(product, error))
+
+    # Clean every product at once, printing any symbols that could not be cleaned
+    with PROFILER.stage('clean_universe', rows=sum(len(df) for df in df_dict.values())):
+        df_dict, flags, report, clean_errors = clean_universe(product_dict, df_dict)
+    for product, error in clean_errors.items():
+        print('Failed to clean {}: {}'.format(product, error))
+    print('Cleaned {} bars: {} trimmed, {} low volumes replaced, {} outlier closes flagged'.format(
+        report['bars'].sum(), report['trimmed'].sum(), report['low_volume'].sum(), report['outliers'].sum()))
 
-    # Iterate through list
-    for product, info in product_dict.items():
-        # Determine what dataframe creator to use
-        if info[0] == 1:
-            df = create_df_crypto(product)
-            df = clean_df_crypto(df)
-            df = replace_low_vol(df)
-        if info[0] == 2:
-            df = create_df_quandl(product, api_key)
-            df = replace_low_vol(df)
+    return df_dict
 
-        df_dict[product] = df
+def set_pragmas(conn, journal_mode=None, synchronous=None):
+    ''' This function takes in a connection to a sqlite db and optionally sets the
+        journal mode and synchronous pragmas used for bulk inserts.  Leaving either
+        as None keeps the sqlite default.
 
-    return df_dict
+        Args: conn - connection to a sqlite db
+              journal_mode - sqlite journal mode (ex. 'WAL', 'DELETE')
+              synchronous - sqlite synchronous setting (ex. 'NORMAL', 'OFF', 'FULL')
+
+        Return: None - sets the pragmas on the connection
+    '''
+    if journal_mode is not None:
+        conn.execute('PRAGMA journal_mode={}'.format(journal_mode))
+    if synchronous is not None:
+        conn.execute('PRAGMA synchronous={}'.format(synchronous))
+
+def bulk_insert(conn, table_name, cols, rows, chunk_size=50000, key=None):
+    ''' This function takes in a connection, a table name, the column names and an
+        iterable of row tuples, and inserts the rows with executemany.  Rows are
+        committed in transactions of chunk_size rows so memory stays bounded for
+        large inputs.  With a key, rows that match an existing row on the key columns
+        update it instead (upsert), so data can be inserted again without duplicates.
+
+        Args: conn - connection to a sqlite db
+              table_name - table to insert into
+              cols - list of column names, in the same order as the row tuples
+              rows - iterable of tuples of values to insert
+              chunk_size - number of rows per transaction
+              key - optional list of the unique key columns to upsert on
+
+        Return: count - total number of rows inserted or updated
+    '''
+    # Build the insert statement once for all rows
+    sql = "INSERT INTO {tn} ({cs}) VALUES ({qs})".format(tn=table_name, cs=', '.join(cols),
+                                                           qs=', '.join(['?'] * len(cols)))
+    if key:
+        updates = ', '.join('{c} = excluded.{c}'.format(c=col) for col in cols if col not in key)
+        sql += " ON CONFLICT ({ks}) DO UPDATE SET {us}".format(ks=', '.join(key), us=updates)
+
+    count = 0
+    chunk = []
+
+    # Insert every full chunk of rows inside its own transaction
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            with conn:
+                conn.executemany(sql, chunk)
+            count += len(chunk)
+            chunk = []
+
+    # Insert any remaining rows
+    if chunk:
+        with conn:
+            conn.executemany(sql, chunk)
+        count += len(chunk)
+
+    return count
+
+def epoch_seconds(dates):
+    ''' This function takes in dates (index, list or array of dates, datetimes or strings)
+        and returns them as an int64 numpy array of epoch seconds, the form stored in the
+        date column of Daily_Prices.
+    '''
+    return pd.to_datetime(dates).values.astype('datetime64[s]').astype(np.int64)
+
+def daily_price_rows(data_id, symbol, df):
+    ''' This is a generator that takes in a data_id, a symbol and a dataframe of daily
+        price information and yields one tuple per bar for the Daily_Prices table.  The
+        dates are converted to integer epoch seconds for the whole index at once and the
+        prices are read from the underlying arrays instead of iterating over rows.
+
+        Args: data_id - id of the data vendor for the symbol
+              symbol - product symbol
+              df - dataframe of price information
+
+        Return: generator of (data_id, symbol, date, open, high, low, close, volume) tuples
+    '''
+    # Convert all dates at once, index can be dates or datetimes
+    dates = epoch_seconds(df.index).tolist()
+
+    # Convert the price arrays to python values sqlite can store
+    values = [df[col].to_numpy().tolist() for col in ['open', 'high', 'low', 'close', 'volume']]
+
+    for date, o, h, l, c, v in zip(dates, *values):
+        yield (data_id, symbol, date, o, h, l, c, v)
 
 def insert_symbols_table(product_dict, sqlite_file, table_name='Symbols'):
     ''' This function takes in a dict of product symbols mapped to
@@ -189,55 +497,167 @@ def insert_symbols_table(product_dict, sqlite_file, table_name='Symbols'):
     # Create the column name list for database insertion
     cols = ['data_id', 'symbol', 'name', 'sector', 'exchange']
 
-    # Open a connection to the database
-    conn = sqlite3.connect(sqlite_file)
-    c = conn.cursor()
-
-    # Iterate through all symbols of product_dict
-    for symbol, s_info in product_dict.items():
-        # Set params and insert row into database
-        params = (s_info[0], symbol, s_info[1], s_info[2], s_info[3])
-        c.execute("INSERT INTO {tn} ({c0}, {c1}, {c2}, {c3}, {c4}) VALUES (?, ?, ?, ?, ?)"\
-            .format(tn=table_name, c0=cols[0], c1=cols[1], c2=cols[2],\
-            c3=cols[3], c4=cols[4]), params)
+    # Set rows to insert for every symbol of product_dict
+    rows = [(s_info[0], symbol, s_info[1], s_info[2], s_info[3])
+            for symbol, s_info in product_dict.items()]
 
-    # Close connection to database
-    conn.commit()
+    # Open a connection to the database, insert or update and close
+    conn = sqlite3.connect(sqlite_file)
+    with PROFILER.stage('insert_symbols_table', rows=len(rows)):
+        bulk_insert(conn, table_name, cols, rows, key=['symbol'])
     conn.close()
 
-def insert_daily_prices_table(product_dict, df_dict, sqlite_file, table_name='Daily_Prices'):
+def insert_daily_prices_table(product_dict, df_dict, sqlite_file, table_name='Daily_Prices',
+                              chunk_size=50000, journal_mode=None, synchronous=None):
     ''' This function takes in a 2 dicts, one with product keys mapping
         to info about the product and the other with product keys mapping
         to a dataframe a daily price information.  It also takes in a sqlite
         file and then uses the info to insert all rows into the Daily_Prices
-        table of the database.
+        table of the database in bulk, and prints the insert rate.  Bars already
+        in the table for the same symbol and date are updated, so the data can be
+        inserted again after new bars arrive.
 
         Args: product_dict - a dict of symbols for products with maps to
                              a list of info
               df_dict - dict of dataframes with futures symbols and price data
               sqlite_file - file for the database to write to
               table_name - default to 'Daily_Prices' for this function
+              chunk_size - number of rows per transaction
+              journal_mode - optional sqlite journal mode (ex. 'WAL')
+              synchronous - optional sqlite synchronous setting (ex. 'NORMAL')
 
-        Return: None - nothing explicit but inserts info into the database
+        Return: count - total number of rows inserted or updated in the database
     '''
     # Create the column name list for database insertion
     cols = ['data_id', 'symbol', 'date', 'open', 'high', 'low', 'close', 'volume']
 
-    # Open a connection to the database
+    # Open a connection to the database and tune it for bulk inserts
     conn = sqlite3.connect(sqlite_file)
-    c = conn.cursor()
-
-    # Iterate through all symbols and then the dataframe to get all price data
-    for symbol, df in df_dict.items():
-        data_id = product_dict[symbol][0]
-        for i, row in df.iterrows():
-            date = i.strftime('%Y-%m-%d')
-            # Set params and insert row into database
-            params = (data_id, symbol, date, row.open, row.high, row.low, row.close, row.volume)
-            c.execute("INSERT INTO {tn} ({c0}, {c1}, {c2}, {c3}, {c4}, {c5}, {c6}, {c7}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"\
-                .format(tn=table_name, c0=cols[0], c1=cols[1], c2=cols[2], c3=cols[3], c4=cols[4],\
-                c5=cols[5], c6=cols[6], c7=cols[7]), params)
+    set_pragmas(conn, journal_mode, synchronous)
+
+    # Chain the rows of all symbols into a single stream of inserts
+    rows = (row for symbol, df in df_dict.items()
+            for row in daily_price_rows(product_dict[symbol][0], symbol, df))
+
+    with PROFILER.stage('insert_daily_prices_table') as record:
+        start = time.perf_counter()
+        count = bulk_insert(conn, table_name, cols, rows, chunk_size, key=['symbol', 'date'])
+        elapsed = time.perf_counter() - start
+        record['rows'] = count
 
     # Close connection to database
-    conn.commit()
     conn.close()
+
+    # Print out insert rate
+    print('Inserted {} rows in {:.2f}s ({:.0f} rows/sec)'.format(count, elapsed, count / max(elapsed, 1e-9)))
+
+    return count
+
+def date_key(date):
+    ''' This function takes in a date (string, datetime or Timestamp) and returns it in the
+        form stored in the date column of Daily_Prices, for range filters.
+    '''
+    return int(epoch_seconds([date])[0])
+
+def connect_read_only(sqlite_file):
+    ''' This function takes in a sqlite db file and returns a read-only connection to it,
+        raising IOError instead of creating an empty database if the file does not exist.
+    '''
+    if not os.path.exists(sqlite_file):
+        raise IOError('Database {} does not exist'.format(sqlite_file))
+
+    return sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(sqlite_file))), uri=True)
+
+def read_symbol_prices(sqlite_file, symbol, start_date=None, end_date=None, chunk_size=100000,
+                       table_name='Daily_Prices'):
+    ''' This function takes in a sqlite db file and a symbol and reads the symbol's daily
+        prices back into a dataframe in the format of the acquired data.  Rows are fetched in
+        chunks and each chunk is converted to typed numpy arrays at once, with the epoch
+        dates turned into datetime64 in a single vectorized step.  The (symbol, date) key of
+        Daily_Prices means only the symbol's rows in the date range are read.
+
+        Args: sqlite_file - file of the database to read from
+              symbol - product symbol
+              start_date - optional first date to read
+              end_date - optional last date to read
+              chunk_size - number of rows fetched at a time
+              table_name - default to 'Daily_Prices' for this function
+
+        Return: df - dataframe of daily price info for symbol with a 'Date' index
+    '''
+    # Build the query with the optional date range
+    sql = 'SELECT date, open, high, low, close, volume FROM {tn} WHERE symbol = ?'.format(tn=table_name)
+    params = [symbol]
+    if start_date is not None:
+        sql += ' AND date >= ?'
+        params.append(date_key(start_date))
+    if end_date is not None:
+        sql += ' AND date <= ?'
+        params.append(date_key(end_date))
+    sql += ' ORDER BY date'
+
+    conn = connect_read_only(sqlite_file)
+    cursor = conn.execute(sql, params)
+
+    # Convert every chunk of rows to typed arrays
+    dates, values = [], []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        cols = list(zip(*rows))
+        dates.append(np.array(cols[0], dtype=np.int64).astype('datetime64[s]'))
+        values.append(np.array(cols[1:], dtype=np.float64).T)
+    conn.close()
+
+    dates = np.concatenate(dates) if dates else np.array([], dtype='datetime64[s]')
+    values = np.concatenate(values) if values else np.empty((0, 5))
+
+    index = pd.DatetimeIndex(dates.astype('datetime64[ns]'), name='Date')
+
+    return pd.DataFrame(values, index=index, columns=['open', 'high', 'low', 'close', 'volume'])
+
+def load_df_dict(sqlite_file, symbols=None, start_date=None, end_date=None, workers=None,
+                 chunk_size=100000):
+    ''' This function takes in a sqlite db file filled by insert_daily_prices_table and
+        rebuilds the dict of symbols mapped to dataframes of daily price information, so the
+        data does not have to be fetched from the vendors again.  Symbols are read in
+        parallel threads, each with its own read-only connection, when workers is more than 1.
+
+        Args: sqlite_file - file of the database to read from
+              symbols - optional list of symbols to read, None for every symbol in the
+                        Symbols table in the order they were inserted
+              start_date - optional first date to read
+              end_date - optional last date to read
+              workers - number of reader threads, None or 1 to read serially
+              chunk_size - number of rows fetched at a time
+
+        Return: df_dict - a dictionary of symbols mapped to dataframes of price info, symbols
+                          without any rows in the date range are left out
+    '''
+    # Read the symbols in insertion order
+    if symbols is None:
+        conn = connect_read_only(sqlite_file)
+        symbols = [row[0] for row in conn.execute('SELECT symbol FROM Symbols ORDER BY id')]
+        conn.close()
+
+    read = partial(read_symbol_prices, sqlite_file, start_date=start_date, end_date=end_date,
+                   chunk_size=chunk_size)
+
+    with PROFILER.stage('load_df_dict') as record:
+        start = time.perf_counter()
+        if not workers or workers <= 1:
+            frames = [read(symbol) for symbol in symbols]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                frames = list(pool.map(read, symbols))
+        elapsed = time.perf_counter() - start
+
+        df_dict = {symbol: df for symbol, df in zip(symbols, frames) if len(df)}
+        count = sum(len(df) for df in df_dict.values())
+        record['rows'] = count
+
+    # Print out read rate
+    print('Read {} rows in {:.2f}s ({:.0f} rows/sec)'.format(count, elapsed, count / max(elapsed, 1e-9)))
+
+    return df_dict
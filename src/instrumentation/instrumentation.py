@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the instrumentation used to see which pipeline stage, and which
+    product within a stage, dominates a run.  The pipeline functions record into the shared
+    PROFILER, which does nothing until it is enabled.
+"""
+
+import os
+import time
+import json
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+
+# Columns of each stage record
+RECORD_COLUMNS = ['stage', 'product', 'wall_s', 'cpu_s', 'rows', 'peak_mb']
+
+class Profiler(object):
+    ''' This class records wall time, CPU time, rows processed and peak memory for each
+        stage, and optionally per product within a stage.  While disabled, stage() returns a
+        no-op context with a fresh dict, so the hooks cost next to nothing and what a caller
+        writes into the record never reaches another stage.
+
+        CPU time is for the recording thread only, so work done in pool workers is not
+        included.  Peak memory (tracemalloc) and cProfile captures are only taken on the
+        main thread, and cProfile only for the outermost stage that is open.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.cprofile = False
+        self.records = []
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, memory=False, cprofile=False):
+        ''' This function turns recording on.
+
+            Args: memory - trace peak memory of each stage with tracemalloc
+                  cprofile - capture a cProfile of each outermost stage
+
+            Return: None - starts recording stages
+        '''
+        self.enabled = True
+        self.memory = memory
+        self.cprofile = cprofile
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        ''' This function turns recording off, keeping what was recorded so far '''
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        ''' This function clears all records and profiles '''
+        self.records = []
+        self.profiles = {}
+
+    def stage(self, name, product=None, rows=None):
+        ''' This function returns a context manager that records a stage.  The context yields
+            the record dict, so rows can be set inside the block when they are only known
+            after the work is done.
+
+            Args: name - name of the stage
+                  product - optional product the stage ran for
+                  rows - optional number of rows processed
+
+            Return: context manager yielding the record dict
+        '''
+        if not self.enabled:
+            return nullcontext({})
+        return self.record_stage(name, product, rows)
+
+    @contextmanager
+    def record_stage(self, name, product, rows):
+        ''' Context manager that records a stage, see stage() '''
+        record = {'stage': name, 'product': product, 'wall_s': None, 'cpu_s': None,
+                  'rows': rows, 'peak_mb': None}
+
+        # Keep a stack of open stages per thread for nesting
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        main = threading.current_thread() is threading.main_thread()
+        track_memory = self.memory and main and tracemalloc.is_tracing()
+
+        # Hand the peak so far to the parent stage before resetting it for this one
+        if track_memory:
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {'peak': 0}
+        stack.append(frame)
+
+        profile = None
+        if self.cprofile and main and len(stack) == 1:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall_start
+            record['cpu_s'] = time.thread_time() - cpu_start
+
+            if profile is not None:
+                profile.disable()
+                key = name if product is None else '{}_{}'.format(name, product)
+                self.profiles[key] = pstats.Stats(profile)
+
+            stack.pop()
+            if track_memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_mb'] = peak / 1024 ** 2
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+            self.add(**record)
+
+    def add(self, stage, product=None, wall_s=None, cpu_s=None, rows=None, peak_mb=None):
+        ''' This function adds a record measured elsewhere, ex. in a pool worker '''
+        if not self.enabled:
+            return
+        with self.lock:
+            self.records.append({'stage': stage, 'product': product, 'wall_s': wall_s,
+                                 'cpu_s': cpu_s, 'rows': rows, 'peak_mb': peak_mb})
+
+    def to_frame(self):
+        ''' Return all records as a dataframe with RECORD_COLUMNS '''
+        return pd.DataFrame(self.records, columns=RECORD_COLUMNS)
+
+    def summary(self):
+        ''' Return the records totalled by stage, slowest stage first '''
+        df = self.to_frame()
+        summary = df.groupby('stage', sort=False).agg(wall_s=('wall_s', 'sum'), cpu_s=('cpu_s', 'sum'),
+                                                       rows=('rows', 'sum'), peak_mb=('peak_mb', 'max'),
+                                                       records=('wall_s', 'size'))
+        return summary.sort_values('wall_s', ascending=False)
+
+    def export(self, path):
+        ''' This function writes all records to a .json or .csv file, chosen by extension '''
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump(self.records, f, indent=2)
+        else:
+            self.to_frame().to_csv(path, index=False)
+
+    def dump_profiles(self, folder):
+        ''' This function writes every cProfile capture to a .prof file in folder, which can be
+            read with pstats or snakeviz
+        '''
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for key, stats in self.profiles.items():
+            stats.dump_stats(os.path.join(folder, '{}.prof'.format(key)))
+
+# Shared profiler recorded into by the pipeline functions
+PROFILER = Profiler()
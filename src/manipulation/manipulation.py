@@ -6,9 +6,67 @@
     and analysis
 """
 
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from analysis.analysis import *
+from instrumentation.instrumentation import PROFILER
+
+# Columns of raw price information that the indicators are built from
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# List of all signals built by add_all_indicators
+SIGNAL_LIST = ['vol_bo_long', 'vol_bo_short',
+               'range_bo_long', 'range_bo_short',
+               'ma20_long', 'ma20_short',
+               'ma50_long', 'ma50_short',
+               'ma100_long', 'ma100_short',
+               'bb_long', 'bb_short']
+
+# Strategies whose long and short sides combine_strategies combines by default.  The volume
+# breakout and bollinger band signals are left out, as they always have been.
+COMBINED_STRATEGIES = ['range_bo', 'ma20', 'ma50', 'ma100']
+
+# Number of previous bars needed to rebuild every indicator for a new bar, set by the
+# 100 bar moving average (the 20 bar breakouts and 20 bar returns need 21 and 20)
+WARMUP_BARS = 100
+
+def rolling_mean(series, window):
+    ''' This function takes in a series and a window length and returns the rolling mean.
+        Each mean is computed from its own window only, unlike pandas rolling sums that carry
+        rounding error along the whole history, so the value for a bar is the same whether
+        the series starts 100 bars or 10 years before it.
+
+        Args: series - series of values
+              window - number of bars in the window
+
+        Return: series of rolling means, NaN until the window is full
+    '''
+    values = series.to_numpy(dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = sliding_window_view(values, window).mean(axis=1)
+
+    return pd.Series(out, index=series.index)
+
+def rolling_std(series, window):
+    ''' This function takes in a series and a window length and returns the rolling sample
+        standard deviation, computed from each window only like rolling_mean.
+
+        Args: series - series of values
+              window - number of bars in the window
+
+        Return: series of rolling standard deviations, NaN until the window is full
+    '''
+    values = series.to_numpy(dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = sliding_window_view(values, window).std(axis=1, ddof=1)
+
+    return pd.Series(out, index=series.index)
 
 def vol_bo(row, direction):
     ''' This is a helper function to use in volume breakout column creation.  It takes
@@ -25,8 +83,8 @@ def vol_bo(row, direction):
             return 1
         elif (direction == 'short') and (row['close_lt_prev_l'] < 0.0):
             return 1
-        else:
-            return 0
+
+    return 0
 
 def range_bo(row, direction):
     ''' This is a helper function to use in range breakout column creation.  It takes
@@ -92,46 +150,76 @@ def bb_signal(row, direction):
         else:
             return 0
 
+def signal_flag(mask):
+    ''' This is a helper function that converts a boolean series from a whole-column
+        comparison into a compact 0/1 signal column.  Comparisons against NaN are False,
+        so rows without enough history never signal.
+
+        Args: mask - boolean series of where the signal condition holds
+
+        Return: series of int8 values, 1 if the signal occured, 0 if not
+    '''
+    return mask.astype(np.int8)
+
+def add_signals(df):
+    ''' This function takes in a dataframe that already has the indicator columns built
+        by add_all_indicators and adds every long/short signal column using whole-column
+        comparisons.  It gives the same result as applying vol_bo, range_bo, ma_signal and
+        bb_signal row by row, without the Python-level pass over each row.
+
+        Args: df - dataframe of price information with indicator columns
+
+        Return: df - dataframe with added int8 columns for all signals
+    '''
+    # Volume breakout signals
+    vol_spike = df['volume'] > (2 * df['20day_ave_vol'])
+    df['vol_bo_long'] = signal_flag(vol_spike & (df['close_gt_prev_h'] > 0.0))
+    df['vol_bo_short'] = signal_flag(vol_spike & (df['close_lt_prev_l'] < 0.0))
+
+    # Range breakout signals
+    df['range_bo_long'] = signal_flag(df['high'] > df['20day_high'])
+    df['range_bo_short'] = signal_flag(df['low'] < df['20day_low'])
+
+    # Moving average signals
+    for ma in [20, 50, 100]:
+        df['ma{}_long'.format(ma)] = signal_flag(df['close'] > df['ma{}'.format(ma)])
+        df['ma{}_short'.format(ma)] = signal_flag(df['close'] < df['ma{}'.format(ma)])
+
+    # Bollinger band signals
+    df['bb_long'] = signal_flag(df['low'] < df['bb_low'])
+    df['bb_short'] = signal_flag(df['high'] > df['bb_high'])
+
+    return df
+
 def add_all_indicators(df):
-    ''' This function takes in a cleaned dataframe of price information and uses
-        the helper functions to add all relevant indicators as columns
-        to the dataframe.
+    ''' This function takes in a cleaned dataframe of price information and adds all
+        relevant indicators and their signals as columns to the dataframe.
 
         Args: df - cleaned dataframe of price information
 
         Return: df - cleaned dataframe with added columns for all indicators
     '''
     # All columns for 20day volume breakout indicator
-    df['20day_ave_vol'] = df.volume.rolling(window=20, center=False).mean().shift(1)
+    df['20day_ave_vol'] = rolling_mean(df.volume, 20).shift(1)
     df['close_gt_prev_h'] = df['close'] - df['high'].shift(1)
     df['close_lt_prev_l'] = df['close'] - df['low'].shift(1)
-    df['vol_bo_long'] = df.apply(lambda row: vol_bo(row, direction='long'), axis=1)
-    df['vol_bo_short'] = df.apply(lambda row: vol_bo(row, direction='short'), axis=1)
-    df['vol_bo_long'].fillna(value=0, inplace=True)
-    df['vol_bo_short'].fillna(value=0, inplace=True)
 
     # All columns for 20day range breakout indicator
     df['20day_high'] = df.high.rolling(window=20, center=False).max().shift(1)
     df['20day_low'] = df.low.rolling(window=20, center=False).min().shift(1)
-    df['range_bo_long'] = df.apply(lambda row: range_bo(row, direction='long'), axis=1)
-    df['range_bo_short'] = df.apply(lambda row: range_bo(row, direction='short'), axis=1)
 
     # All columns for moving average indicators
-    df['ma20'] = df['close'].rolling(window=20, center=False).mean()
-    df['ma50'] = df['close'].rolling(window=50, center=False).mean()
-    df['ma100'] = df['close'].rolling(window=100, center=False).mean()
-    df['ma20_long'] = df.apply(lambda row: ma_signal(row, ma=20, direction='long'), axis=1)
-    df['ma20_short'] = df.apply(lambda row: ma_signal(row, ma=20, direction='short'), axis=1)
-    df['ma50_long'] = df.apply(lambda row: ma_signal(row, ma=50, direction='long'), axis=1)
-    df['ma50_short'] = df.apply(lambda row: ma_signal(row, ma=50, direction='short'), axis=1)
-    df['ma100_long'] = df.apply(lambda row: ma_signal(row, ma=100, direction='long'), axis=1)
-    df['ma100_short'] = df.apply(lambda row: ma_signal(row, ma=100, direction='short'), axis=1)
+    df['ma20'] = rolling_mean(df['close'], 20)
+    df['ma50'] = rolling_mean(df['close'], 50)
+    df['ma100'] = rolling_mean(df['close'], 100)
 
     # All columns for bollinger band indicators
-    df['bb_high'] = df['ma20'] + (2 * df['close'].rolling(window=20, center=False).std())
-    df['bb_low'] = df['ma20'] - (2 * df['close'].rolling(window=20, center=False).std())
-    df['bb_long'] = df.apply(lambda row: bb_signal(row, direction='long'), axis=1)
-    df['bb_short'] = df.apply(lambda row: bb_signal(row, direction='short'), axis=1)
+    std20 = rolling_std(df['close'], 20)
+    df['bb_high'] = df['ma20'] + (2 * std20)
+    df['bb_low'] = df['ma20'] - (2 * std20)
+
+    # All signal columns for the indicators above
+    add_signals(df)
 
     # All columns for percentage change for timeframe into the future
     df['pct_change_1day'] = df['close'].pct_change()
@@ -141,19 +229,160 @@ def add_all_indicators(df):
 
     return df
 
-def transform_all_products(prod_dict):
+def frame_bytes(df):
+    ''' This function returns the memory used by a dataframe in bytes, including its index
+        and the contents of any object columns.
+    '''
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def compact_frame(df):
+    ''' This function takes in a dataframe of price and indicator information and converts
+        it in place to compact dtypes, float32 for every float column and int8 for every
+        integer column holding only 0/1 signals.
+
+        Args: df - dataframe of price and indicator information
+
+        Return: df - the same dataframe with compact dtypes
+    '''
+    for col in df.columns:
+        kind = df[col].dtype.kind
+        if kind == 'f' and df[col].dtype != np.float32:
+            df[col] = df[col].astype(np.float32)
+        elif kind in 'iub' and df[col].dtype != np.int8 and df[col].isin([0, 1]).all():
+            df[col] = df[col].astype(np.int8)
+
+    return df
+
+def compact_all_products(prod_dict):
+    ''' This function takes in the dictionary of all product dataframes, converts each to
+        compact dtypes with compact_frame and returns a report of the bytes saved.
+
+        Args: prod_dict - dictionary of name:dataframe key:value pairs for all products
+
+        Return: report_df - dataframe of product, bytes_before, bytes_after and bytes_saved
+    '''
+    report = []
+    for prod, df in prod_dict.items():
+        before = frame_bytes(df)
+        compact_frame(df)
+        after = frame_bytes(df)
+        report.append([prod, before, after, before - after])
+
+    return pd.DataFrame(report, columns=['product', 'bytes_before', 'bytes_after', 'bytes_saved'])
+
+def update_indicators(df, new_bars, warmup=WARMUP_BARS):
+    ''' This function takes in a dataframe already transformed by add_all_indicators and a
+        dataframe of newly arrived price bars, and returns the transformed dataframe extended
+        with the new bars.  Only the new bars and the last warmup bars before them are run
+        through add_all_indicators, instead of the whole history.  Bars that are not after
+        the last date of df are ignored.
+
+        Args: df - dataframe of price and indicator information
+              new_bars - dataframe of new price information, same columns as the raw data
+              warmup - number of previous bars needed to rebuild the indicators
+
+        Return: df - new dataframe of price and indicator information including new_bars
+    '''
+    # Keep only bars after the last transformed date
+    if len(df):
+        new_bars = new_bars[new_bars.index > df.index[-1]]
+    if not len(new_bars):
+        return df
+
+    # Transform the warm-up tail together with the new bars
+    block = pd.concat([df[PRICE_COLUMNS].iloc[-warmup:], new_bars[PRICE_COLUMNS]])
+    add_all_indicators(block)
+
+    # Append only the new rows
+    return pd.concat([df, block.iloc[-len(new_bars):]])
+
+def update_all_products(prod_dict, new_bars_dict):
+    ''' This function takes in the dictionary of all transformed product dataframes and a
+        dictionary of product names to dataframes of new bars, and updates each product in the
+        dict with update_indicators.
+
+        Args: prod_dict - dictionary of name:dataframe key:value pairs for all products
+              new_bars_dict - dictionary of name:dataframe of new bars, products without new
+                              bars can be left out
+
+        Return: None - replaces each updated dataframe in prod_dict
+    '''
+    for prod, new_bars in new_bars_dict.items():
+        prod_dict[prod] = update_indicators(prod_dict[prod], new_bars)
+
+def transform_chunk(items):
+    ''' This is a helper function to use as a process pool task.  It takes in a list of
+        (product, dataframe) pairs and applies add_all_indicators to each.
+
+        Args: items - list of (product name, dataframe) tuples
+
+        Return: list of (product name, transformed dataframe, seconds taken) tuples
+    '''
+    results = []
+    for prod, df in items:
+        start = time.perf_counter()
+        add_all_indicators(df)
+        results.append((prod, df, time.perf_counter() - start))
+
+    return results
+
+def transform_all_products(prod_dict, workers=None, chunk_size=None):
     ''' This function takes in the dictionary of all product dataframes and applies
-        the add_all_indicators function to each.
+        the add_all_indicators function to each.  With more than one worker, products are
+        sent in chunks to a process pool and the transformed dataframes replace the
+        originals in the dict, keeping the original order.
 
         Args: prod_dict - dictionary of name:dataframe key:value pairs for all products
+              workers - number of worker processes, None or 1 to transform serially
+              chunk_size - number of products per pool task, None to split the products
+                           evenly with a few tasks per worker
 
-        Return: None - transforms each dataframe with indicators and returns
+        Return: timings - dict of product name to seconds spent transforming it
     '''
+    with PROFILER.stage('transform_all_products', rows=sum(len(df) for df in prod_dict.values())):
+        if not workers or workers <= 1:
+            return transform_serial(prod_dict)
+        return transform_parallel(prod_dict, workers, chunk_size)
+
+def transform_serial(prod_dict):
+    ''' This function applies add_all_indicators to each dataframe of prod_dict in place and
+        returns a dict of product name to seconds spent transforming it.
+    '''
+    timings = {}
+
     # Iterate through all products in the dict and update
     for prod, df in prod_dict.items():
-        add_all_indicators(df)
+        with PROFILER.stage('add_all_indicators', prod, len(df)):
+            start = time.perf_counter()
+            add_all_indicators(df)
+            timings[prod] = time.perf_counter() - start
+
+    return timings
+
+def transform_parallel(prod_dict, workers, chunk_size=None):
+    ''' This function applies add_all_indicators to chunks of prod_dict on a process pool,
+        puts the transformed dataframes back into prod_dict and returns a dict of product name
+        to seconds spent transforming it.  See transform_all_products for the arguments.
+    '''
+    timings = {}
+
+    # Split the products into chunks to limit the number of pickled tasks
+    items = list(prod_dict.items())
+    if chunk_size is None:
+        chunk_size = max(1, len(items) // (workers * 4))
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+    # Transform chunks in parallel and put the results back into the dict
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(transform_chunk, chunks):
+            for prod, df, seconds in results:
+                prod_dict[prod] = df
+                timings[prod] = seconds
+                PROFILER.add('add_all_indicators', prod, wall_s=seconds, rows=len(df))
+
+    return timings
 
-def create_returns_df(prod_dict, signal_list, timeframe_list=[1, 5, 10, 20]):
+def create_returns_df(prod_dict, signal_list, timeframe_list=[1, 5, 10, 20], compact=False):
     ''' This function takes in a dict of product symbols mapped to dataframes of price and
         indicator information, a list of signals, and a list of timeframes.  It generates
         a new dataframe of products, signals, timeframes, and return statistics.
@@ -161,37 +390,86 @@ def create_returns_df(prod_dict, signal_list, timeframe_list=[1, 5, 10, 20]):
         Args: prod_dict - dict of product symbols mapped to dataframes of price info
               signal_list - list of strings of signal names
               timeframe_list - list of ints that represent timeframes for returns
+              compact - use COMPACT_RETURNS_SCHEMA, with categorical product, signal and
+                        timeframe columns, instead of RETURNS_SCHEMA
 
         Return: returns_df - dataframe of products, signals, timeframes and return stats
     '''
-    # Create empty dataframe in order to insert data
-    returns_df = pd.DataFrame(columns=['product', 'signal', 'timeframe',
-                              'signal_count', 'signals_per_day', 'ave_return', 'std_return',
-                              'min_return', 'max_return', 'q25_return', 'q75_return'])
+    with PROFILER.stage('create_returns_df', rows=sum(len(df) for df in prod_dict.values())):
+        # Compute the stats of every signal/timeframe of each product in one batch
+        frames = []
+        for prod, df in prod_dict.items():
+            with PROFILER.stage('batch_return_stats', prod, len(df)):
+                frames.append(batch_return_stats(prod, df, signal_list, timeframe_list))
 
-    # Set variable to keep track of index in dataframe
-    i = 0
+        # Assemble all products once, numbering rows like the product/signal/timeframe loop
+        returns_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=STATS_COLUMNS)
 
-    # Iterate through each product, for each signal, for each timeframe
-    for prod, df in prod_dict.items():
-        for signal in signal_list:
-            for timeframe in timeframe_list:
-                # Insert row of data into dataframe
-                returns_df.loc[i] = return_stats(prod, df, signal, timeframe)
-                i += 1
+        # Drop null values and set the dtypes of every column
+        returns_df.dropna(inplace=True)
+        returns_df = returns_df.astype(COMPACT_RETURNS_SCHEMA if compact else RETURNS_SCHEMA)
+
+    return returns_df
+
+def forward_return_matrix(close, horizons=[1, 5, 10, 20]):
+    ''' This function takes in a series of closing prices and a list of horizons and returns
+        the forward return of every bar over every horizon as one (bars x horizons) array.
+        Row t holds close[t + h] / close[t] - 1, the return of entering on the close of a
+        signal bar and holding for h bars, and is NaN where t + h runs past the data.  All
+        horizons are read from one strided (bars x max horizon + 1) view of the closes.
+
+        Args: close - series or array of closing prices
+              horizons - list of ints of bars to hold for
+
+        Return: forward - (bars x horizons) numpy array of forward returns
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    max_h = max(horizons)
+
+    # Pad the end so every bar has a full window of future closes
+    padded = np.concatenate([close, np.full(max_h, np.nan)])
+    windows = sliding_window_view(padded, max_h + 1)[:len(close)]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        forward = windows[:, horizons] / windows[:, :1] - 1.0
+
+    return forward
+
+def create_forward_returns_df(prod_dict, signal_list, horizons=[1, 5, 10, 20], compact=False):
+    ''' This function takes in a dict of product symbols mapped to dataframes of price and
+        indicator information, a list of signals and a list of horizons, and generates the same
+        dataframe as create_returns_df but with forward returns from each signal bar, taken
+        from forward_return_matrix.  Any list of horizons can be used without adding columns
+        to the product dataframes.
 
-    # Drop null values
-    returns_df.dropna(inplace=True)
+        Args: prod_dict - dict of product symbols mapped to dataframes of price info
+              signal_list - list of strings of signal names
+              horizons - list of ints of bars to hold for, reported in the timeframe column
+              compact - use COMPACT_RETURNS_SCHEMA instead of RETURNS_SCHEMA
+
+        Return: returns_df - dataframe of products, signals, timeframes and return stats
+    '''
+    with PROFILER.stage('create_forward_returns_df', rows=sum(len(df) for df in prod_dict.values())):
+        frames = []
+        for prod, df in prod_dict.items():
+            forward = forward_return_matrix(df['close'], horizons)
+            frames.append(batch_return_stats(prod, df, signal_list, horizons, returns=forward))
+
+        # Assemble all products once, drop null values and set the dtypes of every column
+        returns_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=STATS_COLUMNS)
+        returns_df.dropna(inplace=True)
+        returns_df = returns_df.astype(COMPACT_RETURNS_SCHEMA if compact else RETURNS_SCHEMA)
 
     return returns_df
 
-def filter_strategies(df, thresh=150):
+def filter_strategies(df, thresh=150, max_p_value=None):
     ''' This function takes in a dataframe of returns and a min trade count and returns
         a filtered dataframe without the bb strategy and only strategies that reach the
         threshold for trade count.
 
         Args: df - dataframe to filter
               thresh - min number of trades needed to remain in dataframe
+              max_p_value - optional max p_value (from add_significance) to remain in dataframe
 
         Return: df_final - filtered dataframe
     '''
@@ -199,7 +477,11 @@ def filter_strategies(df, thresh=150):
     df_final = df[(df['signal'] != 'bb_long') & (df['signal'] != 'bb_short')]
 
     # Filter out strategies with trade count below the threshold
-    df_final = df_final[df_final['signal_count'] > 150]
+    df_final = df_final[df_final['signal_count'] > thresh]
+
+    # Filter out strategies that are not significant
+    if max_p_value is not None:
+        df_final = df_final[df_final['p_value'] <= max_p_value]
 
     # Create list of strategies to drop based on not having the other direction reach thresh
     drops = [('BTC', 'range_bo_long'), ('XLM', 'ma50_short'), ('XLM', 'ma20_short'),
@@ -211,7 +493,17 @@ def filter_strategies(df, thresh=150):
 
     return df_final
 
-def calculate_combined(df, prod, sig, tf, sig_map):
+def split_signal(signal):
+    ''' This function takes in a signal name and splits it into the strategy name and the
+        trade direction, ex. 'ma20_long' -> ('ma20', 'long').  Signals without a direction
+        return (signal, None).
+    '''
+    match = re.match(r'^(.*)_(long|short)$', signal)
+    if match:
+        return match.group(1), match.group(2)
+    return signal, None
+
+def calculate_combined(df, prod, sig, tf, sig_map=None):
     ''' This function takes in a dataframe, product, signal, timeframe and signal_map and returns
         both the combined average return and total signal count for each strategy long/short combination.
 
@@ -219,15 +511,23 @@ def calculate_combined(df, prod, sig, tf, sig_map):
               prod - product name
               sig - signal name
               tf - timeframe
-              sig_map - a dict that maps the long strategy to the short strategy
+              sig_map - a dict that maps the long strategy to the short strategy, None to pair
+                        the signal with the same strategy name ending in '_short'
+
+        df can also be given already indexed by ['product', 'signal', 'timeframe'], so many
+        strategies can be looked up without building the index again for each one.
 
         Return: combined ave return, total signal count
     '''
+    # Find the short side of the strategy
+    short_sig = sig_map[sig] if sig_map is not None else split_signal(sig)[0] + '_short'
+
     # Get the individual counts, returns for long and short trades
-    long_count, long_ave_return = df[(df['product'] == prod) & (df['signal'] == sig) &\
-                                     (df['timeframe'] == tf)].iloc[0][['signal_count', 'ave_return']]
-    short_count, short_ave_return = df[(df['product'] == prod) & (df['signal'] == sig_map[sig]) &\
-                                       (df['timeframe'] == tf)].iloc[0][['signal_count', 'ave_return']]
+    if list(df.index.names) != ['product', 'signal', 'timeframe']:
+        df = df.set_index(['product', 'signal', 'timeframe'])
+    rows = df[['signal_count', 'ave_return']]
+    long_count, long_ave_return = rows.loc[(prod, sig, tf)]
+    short_count, short_ave_return = rows.loc[(prod, short_sig, tf)]
 
     # Get total number of trades
     total_count = long_count + short_count
@@ -238,34 +538,57 @@ def calculate_combined(df, prod, sig, tf, sig_map):
 
     return combined_ave_return, total_count
 
-def combine_strategies(df):
+def combine_strategies(df, strategies=COMBINED_STRATEGIES):
     ''' This function takes in a dataframe and combines each long/short side of a strategy
-        then returns a dataframe of the resulting information.
+        then returns a dataframe of the resulting information.  The sides are paired by
+        signal name, ex. 'ma20_long' with 'ma20_short', and only strategies with both
+        sides present for a product and timeframe are combined.
 
         Args: df - dataframe to combine strategies for
+              strategies - list of strategy names to combine, None to combine every
+                           long/short pair (ex. the parameterized signals of sweep_signals)
 
         Return: df_combined - dataframe of combined strategies
     '''
-    # Create a signal map for each strategy pair, list of timeframes and empty list to hold data
-    signal_map = {'range_bo_long': 'range_bo_short',
-                  'ma20_long': 'ma20_short',
-                  'ma50_long': 'ma50_short',
-                  'ma100_long': 'ma100_short'}
-
-    timeframes = [1, 5, 10, 20]
-    combined = []
-
-    # Iterate through each combination and append the information
-    for product in df['product'].unique():
-        for timeframe in timeframes:
-            for signal in signal_map:
-                if signal in list(df[df['product'] == product].signal):
-                    combined_return, combined_count = calculate_combined(df, product, signal, timeframe, signal_map)
-                    combined.append([product, signal[:-5], timeframe, combined_return, combined_count])
-
-    # Put data into a dataframe and name columns appropriately
-    df_combined = pd.DataFrame(combined)
-    df_combined.columns = ['product', 'signal', 'timeframe', 'ave_return', 'signal_count']
+    with PROFILER.stage('combine_strategies', rows=len(df)):
+        return combine_sides(df, strategies)
+
+def combine_sides(df, strategies=COMBINED_STRATEGIES):
+    ''' This function does the work of combine_strategies, see there for the arguments '''
+    # Split each signal name into the strategy name and direction
+    sides = df[['product', 'signal', 'timeframe', 'signal_count', 'ave_return']].copy()
+    split = sides['signal'].str.extract(r'^(.*)_(long|short)$')
+    sides['signal'] = split[0]
+    direction = split[1]
+
+    # Keep only the strategies to combine
+    if strategies is not None:
+        direction = direction.where(sides['signal'].isin(strategies))
+
+    # Match each long row with the short row of the same product, strategy and timeframe
+    keys = ['product', 'signal', 'timeframe']
+    merged = sides[direction == 'long'].merge(sides[direction == 'short'], on=keys,
+                                              suffixes=('_long', '_short'))
+
+    # Calculate total number of trades and combined ave return
+    long_count = merged['signal_count_long']
+    short_count = merged['signal_count_short']
+    total_count = long_count + short_count
+    weights = total_count.astype(float)
+    combined_ave_return = ((long_count / weights) * merged['ave_return_long']) +\
+                            ((short_count / weights) * merged['ave_return_short'])
+
+    df_combined = pd.DataFrame({'product': merged['product'],
+                                'signal': merged['signal'],
+                                'timeframe': merged['timeframe'],
+                                'ave_return': combined_ave_return,
+                                'signal_count': total_count})
+
+    # Order by product, then timeframe, keeping the signal order within each
+    product_order = {prod: i for i, prod in enumerate(df['product'].unique())}
+    df_combined['order'] = df_combined['product'].map(product_order)
+    df_combined = df_combined.sort_values(['order', 'timeframe'], kind='mergesort')
+    df_combined = df_combined.drop(columns='order').reset_index(drop=True)
 
     return df_combined
 
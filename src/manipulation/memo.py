@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains an on-disk memo of transformed product dataframes.  Each frame is
+    stored under a fingerprint of its input price arrays and the indicator configuration,
+    so a repeat run on unchanged data loads the transformed frames instead of building the
+    indicators again, and any change to the bars or the indicators gives a new key.
+"""
+
+import os
+import json
+import time
+import types
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from manipulation.manipulation import (add_all_indicators, add_signals, signal_flag, rolling_mean,
+                                       rolling_std, transform_all_products)
+from manipulation import panel
+from manipulation.panel import Panel, transform_panel
+from instrumentation.instrumentation import PROFILER
+
+def code_fingerprint(*funcs):
+    ''' This function takes in functions and returns a hash of their bytecode, constants and
+        the names they use, so any edit to them, like a changed window, gives a new hash.
+    '''
+    h = hashlib.sha1()
+
+    def update(code):
+        h.update(code.co_code)
+        h.update(repr(code.co_names).encode())
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                update(const)
+            else:
+                h.update(repr(const).encode())
+
+    for func in funcs:
+        update(func.__code__)
+
+    return h.hexdigest()
+
+# Part of every key.  The parameters are a hand copy of the literals in add_all_indicators,
+# kept to make the key readable, nothing reads them.  What ties the key to the indicator code
+# is 'code', a hash of the functions that build the indicators, both add_all_indicators and
+# the Panel path transform_cached uses with panel=True, so editing either gives new keys.
+# Bump version by hand for changes that do not show there (ex. a pandas upgrade that changes
+# rolling or pct_change), so frames from before are not reused.
+INDICATOR_CONFIG = {'transform': 'add_all_indicators',
+                    'version': 1,
+                    'code': code_fingerprint(add_all_indicators, add_signals, signal_flag,
+                                             rolling_mean, rolling_std, Panel.add_indicators,
+                                             Panel.pack, Panel.unpack,
+                                             *[getattr(panel, name) for name in sorted(dir(panel))
+                                               if name.startswith('packed_')]),
+                    'volume_window': 20,
+                    'volume_spike': 2,
+                    'range_window': 20,
+                    'ma_windows': [20, 50, 100],
+                    'bb_window': 20,
+                    'bb_stds': 2,
+                    'pct_change_periods': [1, 5, 10, 20]}
+
+def frame_fingerprint(df, config=INDICATOR_CONFIG):
+    ''' This function takes in a dataframe of price information and an indicator configuration
+        and returns a hash of the dates, the name, dtype and values of every column (the OHLCV
+        arrays of a raw frame) and the configuration.  The dates are hashed as datetime64
+        values with the dtype of the index, so the datetime.date index of crypto frames works
+        too and does not share keys with the same dates in a DatetimeIndex.
+
+        Args: df - dataframe of price information
+              config - json serializable dict of indicator parameters
+
+        Return: key - hex string fingerprint
+    '''
+    h = hashlib.sha1(json.dumps(config, sort_keys=True).encode())
+    h.update('index:{}'.format(df.index.dtype).encode())
+    h.update(np.ascontiguousarray(pd.to_datetime(df.index).asi8).view(np.uint8))
+    for col in df.columns:
+        values = np.ascontiguousarray(df[col].to_numpy())
+        h.update('{}:{}:{}'.format(col, values.dtype, len(values)).encode())
+        h.update(values.view(np.uint8))
+
+    return h.hexdigest()
+
+class TransformCache(object):
+    ''' This class keeps transformed dataframes on disk, one pickle file per fingerprint.
+        A hit refreshes the file's modification time, so when the files grow past max_bytes
+        the least recently used ones are evicted first.  Hits, misses, stores and evictions
+        are counted for stats.
+
+        Args: cache_dir - folder to keep the cache files in
+              max_bytes - max total size of the cache files, None for no limit
+    '''
+    def __init__(self, cache_dir='transform_cache', max_bytes=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, key):
+        ''' Return the cache file path for a fingerprint '''
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def load(self, key):
+        ''' Return the cached dataframe of a fingerprint and mark it as used, None if missing.
+            A file that cannot be read back (ex. truncated or corrupt) is removed and also
+            counted as a miss.
+        '''
+        path = self.path(key)
+        try:
+            df = pd.read_pickle(path)
+            os.utime(path)
+        except OSError:
+            self.counts['misses'] += 1
+            return None
+        except Exception:
+            # A bad pickle can raise UnpicklingError, EOFError or most other errors
+            self.counts['misses'] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        self.counts['hits'] += 1
+        return df
+
+    def store(self, key, df):
+        ''' Write a dataframe to the cache and evict old files if over max_bytes '''
+        path = self.path(key)
+
+        # Write to a temp file first so readers never see a partial file
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+        self.counts['stores'] += 1
+
+        self.evict()
+
+    def files(self):
+        ''' Return a list of (last used time, size, name) of every cache file '''
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        return files
+
+    def evict(self):
+        ''' Remove the least recently used files until the cache fits in max_bytes '''
+        if self.max_bytes is None:
+            return
+
+        with self.lock:
+            files = self.files()
+            total = sum(f[1] for f in files)
+            for mtime, size, name in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+                self.counts['evictions'] += 1
+
+    def get(self, df, transform=add_all_indicators, config=INDICATOR_CONFIG):
+        ''' This function returns the transformed version of a dataframe, from the cache if the
+            same input was transformed with the same configuration before.
+
+            Args: df - dataframe of price information
+                  transform - function that takes in df and returns it transformed
+                  config - json serializable dict of the parameters of transform
+
+            Return: df - transformed dataframe
+        '''
+        key = frame_fingerprint(df, config)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+
+        df = transform(df)
+        self.store(key, df)
+
+        return df
+
+    def stats(self):
+        ''' Return a dict of hits, misses, hit_rate, stores, evictions, files and bytes '''
+        files = self.files()
+        lookups = self.counts['hits'] + self.counts['misses']
+        stats = dict(self.counts)
+        stats['hit_rate'] = self.counts['hits'] / lookups if lookups else np.nan
+        stats['files'] = len(files)
+        stats['bytes'] = sum(f[1] for f in files)
+
+        return stats
+
+    def clear(self):
+        ''' Remove every file from the cache '''
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+def transform_cached(prod_dict, cache, workers=None, panel=False, config=INDICATOR_CONFIG):
+    ''' This function takes in the dictionary of all product dataframes and a TransformCache,
+        and replaces each dataframe with its transformed version.  Products found in the cache
+        are loaded, and only the rest are transformed, with transform_all_products or
+        transform_panel, and then stored.
+
+        Args: prod_dict - dictionary of name:dataframe key:value pairs for all products
+              cache - TransformCache to load from and store to
+              workers - number of worker processes for transform_all_products
+              panel - True to transform the missing products with transform_panel
+              config - indicator configuration, part of every key
+
+        Return: timings - dict of product name to seconds spent loading or transforming it
+    '''
+    timings, missing, keys = {}, {}, {}
+
+    with PROFILER.stage('transform_cached', rows=sum(len(df) for df in prod_dict.values())):
+        # Load every product that was transformed before
+        for prod, df in prod_dict.items():
+            start = time.perf_counter()
+            keys[prod] = frame_fingerprint(df, config)
+            cached = cache.load(keys[prod])
+            if cached is None:
+                missing[prod] = df
+            else:
+                prod_dict[prod] = cached
+                timings[prod] = time.perf_counter() - start
+
+        # Transform the rest in one batch and store them
+        if missing:
+            start = time.perf_counter()
+            if panel:
+                transform_panel(missing)
+            else:
+                timings.update(transform_all_products(missing, workers=workers))
+            for prod, df in missing.items():
+                prod_dict[prod] = df
+                cache.store(keys[prod], df)
+                timings.setdefault(prod, (time.perf_counter() - start) / len(missing))
+
+    return timings
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the panel form of the product data, one (date x symbol) array per
+    column on the union of every product's dates with a mask of which symbol has a bar on
+    which date.  add_indicators builds every indicator and signal of add_all_indicators for
+    all symbols in one pass of 2-D array operations, and to_dict turns the panel back into
+    the dict of product dataframes used by the rest of the pipeline.
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from manipulation.manipulation import PRICE_COLUMNS
+from instrumentation.instrumentation import PROFILER
+
+def packed_mean(values, window):
+    ''' This function takes in a (symbols x bars) array and returns the rolling mean of each
+        row, computed from each window only like rolling_mean, NaN until the window is full.
+    '''
+    out = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        out[:, window - 1:] = sliding_window_view(values, window, axis=1).mean(axis=-1)
+
+    return out
+
+def packed_std(values, window):
+    ''' This function takes in a (symbols x bars) array and returns the rolling sample
+        standard deviation of each row, like rolling_std, NaN until the window is full.
+    '''
+    out = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        out[:, window - 1:] = sliding_window_view(values, window, axis=1).std(axis=-1, ddof=1)
+
+    return out
+
+def packed_extreme(values, window, func):
+    ''' This function takes in a (symbols x bars) array, a window length and np.max or np.min
+        and returns the rolling max or min of each row, NaN until the window is full.
+    '''
+    out = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        out[:, window - 1:] = func(sliding_window_view(values, window, axis=1), axis=-1)
+
+    return out
+
+def packed_shift(values, periods=1):
+    ''' This function returns a (symbols x bars) array shifted forward by periods bars '''
+    out = np.full(values.shape, np.nan)
+    if values.shape[1] > periods:
+        out[:, periods:] = values[:, :-periods]
+
+    return out
+
+def packed_ffill(values):
+    ''' This function returns a (symbols x bars) array with each NaN replaced by the last
+        value before it in its row, NaN before the first value, like ffill on each row.
+    '''
+    last = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(last, axis=1, out=last)
+
+    return values[np.arange(values.shape[0])[:, None], last]
+
+def packed_pct_change(values, periods=1):
+    ''' This function returns the percent change of each row over periods bars, like
+        pct_change on each product's close.  NaN values are forward filled first, as pandas
+        pct_change does by default, so a missing close gives the same values as there.
+    '''
+    values = packed_ffill(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return values / packed_shift(values, periods) - 1
+
+class Panel(object):
+    ''' This class holds the product data as (date x symbol) arrays.  Products trade on
+        different calendars (ex. crypto every day, futures on business days), so dates is the
+        union of every product's dates and mask marks the dates each symbol has a bar on.
+        Missing bars are NaN in float fields and 0 in signal fields.
+
+        Rolling indicators are built over each symbol's own bars, not calendar dates, so a
+        20 bar moving average is the same as add_all_indicators on that product alone.  For
+        this the bars of each symbol are packed to the front of a (symbols x bars) array,
+        computed, and unpacked back onto the date grid.
+
+        Args: dates - DatetimeIndex of every date in the panel
+              symbols - list of symbols
+              mask - (date x symbol) boolean array, True where the symbol has a bar
+              fields - dict of column names mapped to (date x symbol) arrays
+    '''
+
+    def __init__(self, dates, symbols, mask, fields):
+        self.dates = dates
+        self.symbols = list(symbols)
+        self.mask = mask
+        self.fields = fields
+
+        # Position of every bar in the packed (symbols x bars) layout
+        self.sym_idx, self.date_idx = np.nonzero(mask.T)
+        counts = mask.sum(axis=0)
+        starts = np.cumsum(counts) - counts
+        self.bar_idx = np.arange(len(self.sym_idx)) - np.repeat(starts, counts)
+        self.n_bars = int(counts.max()) if len(counts) else 0
+
+    @classmethod
+    def from_dict(cls, prod_dict, columns=None):
+        ''' This function takes in a dict of product symbols mapped to dataframes and returns
+            a Panel of their columns on the union of their dates.
+
+            Args: prod_dict - dict of product symbols mapped to dataframes of price info
+                  columns - list of columns to keep, None for every column of the first product
+
+            Return: panel - Panel of the products
+        '''
+        symbols = list(prod_dict)
+        frames = [prod_dict[sym] for sym in symbols]
+        if columns is None:
+            columns = list(frames[0].columns) if frames else list(PRICE_COLUMNS)
+
+        # Union of every product's dates, keeping the index name.  Vendors index their frames
+        # differently (ex. datetime.date objects for crypto, a DatetimeIndex for futures), so
+        # every index is converted to a DatetimeIndex first.
+        indexes = [pd.DatetimeIndex(pd.to_datetime(df.index)) for df in frames]
+        dates = pd.DatetimeIndex(np.unique(np.concatenate([index.values for index in indexes]))
+                                 if frames else [], name=frames[0].index.name if frames else None)
+
+        mask = np.zeros((len(dates), len(symbols)), dtype=bool)
+        rows = []
+        for j, index in enumerate(indexes):
+            pos = dates.get_indexer(index)
+            mask[pos, j] = True
+            rows.append(pos)
+
+        fields = {}
+        for col in columns:
+            signal = bool(frames) and frames[0][col].dtype == np.int8
+            grid = np.zeros(mask.shape, dtype=np.int8) if signal else np.full(mask.shape, np.nan)
+            for j, df in enumerate(frames):
+                grid[rows[j], j] = df[col].to_numpy()
+            fields[col] = grid
+
+        return cls(dates, symbols, mask, fields)
+
+    def pack(self, name):
+        ''' Return a field as a (symbols x bars) float array with each symbol's bars in order
+            at the front of its row and NaN after.
+        '''
+        packed = np.full((len(self.symbols), self.n_bars), np.nan)
+        packed[self.sym_idx, self.bar_idx] = self.fields[name][self.date_idx, self.sym_idx]
+
+        return packed
+
+    def unpack(self, name, packed, signal=False):
+        ''' Put a (symbols x bars) array back onto the date grid as field name.  Signals are
+            stored as int8 with 0 on missing bars, everything else as float with NaN.
+        '''
+        grid = np.zeros(self.mask.shape, dtype=np.int8) if signal else np.full(self.mask.shape, np.nan)
+        grid[self.date_idx, self.sym_idx] = packed[self.sym_idx, self.bar_idx]
+        self.fields[name] = grid
+
+    def frame(self, name):
+        ''' Return a field as a (date x symbol) dataframe '''
+        return pd.DataFrame(self.fields[name], index=self.dates, columns=self.symbols)
+
+    def add_indicators(self):
+        ''' This function builds every indicator, signal and pct_change column of
+            add_all_indicators for all symbols at once and adds them as fields, in the same
+            order and with the same values as add_all_indicators gives for each product.
+
+            Return: panel - the panel with the added fields
+        '''
+        with PROFILER.stage('panel_add_indicators', rows=int(self.mask.sum())):
+            high, low = self.pack('high'), self.pack('low')
+            close, volume = self.pack('close'), self.pack('volume')
+            ind = {}
+
+            # All columns for 20day volume breakout indicator
+            ind['20day_ave_vol'] = packed_shift(packed_mean(volume, 20))
+            ind['close_gt_prev_h'] = close - packed_shift(high)
+            ind['close_lt_prev_l'] = close - packed_shift(low)
+
+            # All columns for 20day range breakout indicator
+            ind['20day_high'] = packed_shift(packed_extreme(high, 20, np.max))
+            ind['20day_low'] = packed_shift(packed_extreme(low, 20, np.min))
+
+            # All columns for moving average indicators
+            for ma in [20, 50, 100]:
+                ind['ma{}'.format(ma)] = packed_mean(close, ma)
+
+            # All columns for bollinger band indicators
+            std20 = packed_std(close, 20)
+            ind['bb_high'] = ind['ma20'] + (2 * std20)
+            ind['bb_low'] = ind['ma20'] - (2 * std20)
+
+            for name, values in ind.items():
+                self.unpack(name, values)
+
+            # All signal columns, like add_signals
+            vol_spike = volume > (2 * ind['20day_ave_vol'])
+            signals = {'vol_bo_long': vol_spike & (ind['close_gt_prev_h'] > 0.0),
+                       'vol_bo_short': vol_spike & (ind['close_lt_prev_l'] < 0.0),
+                       'range_bo_long': high > ind['20day_high'],
+                       'range_bo_short': low < ind['20day_low']}
+            for ma in [20, 50, 100]:
+                signals['ma{}_long'.format(ma)] = close > ind['ma{}'.format(ma)]
+                signals['ma{}_short'.format(ma)] = close < ind['ma{}'.format(ma)]
+            signals['bb_long'] = low < ind['bb_low']
+            signals['bb_short'] = high > ind['bb_high']
+
+            for name, values in signals.items():
+                self.unpack(name, values, signal=True)
+
+            # All columns for percentage change for timeframe into the future
+            for timeframe in [1, 5, 10, 20]:
+                self.unpack('pct_change_{}day'.format(timeframe), packed_pct_change(close, timeframe))
+
+        return self
+
+    def years_map(self):
+        ''' Return a dict of symbols to number of years of bars, like generate_years_map '''
+        return dict(zip(self.symbols, self.mask.sum(axis=0) / 260))
+
+    def to_dict(self, columns=None):
+        ''' This function turns the panel back into a dict of product symbols mapped to
+            dataframes of only the dates each product has a bar on.
+
+            Args: columns - list of fields to include, None for every field
+
+            Return: prod_dict - dict of product symbols mapped to dataframes
+        '''
+        columns = list(self.fields) if columns is None else columns
+        prod_dict = {}
+        for j, sym in enumerate(self.symbols):
+            rows = self.mask[:, j]
+            prod_dict[sym] = pd.DataFrame({col: self.fields[col][rows, j] for col in columns},
+                                          index=self.dates[rows], columns=columns)
+
+        return prod_dict
+
+def transform_panel(prod_dict):
+    ''' This function takes in the dictionary of all product dataframes, builds every
+        indicator for all products at once on a Panel and replaces each dataframe in the dict
+        with its transformed version.  It is an alternative to transform_all_products that
+        gives the same dataframes, each keeping its original index.
+
+        Args: prod_dict - dictionary of name:dataframe key:value pairs for all products
+
+        Return: panel - the transformed Panel
+    '''
+    with PROFILER.stage('transform_panel', rows=sum(len(df) for df in prod_dict.values())):
+        panel = Panel.from_dict(prod_dict).add_indicators()
+        for prod, df in panel.to_dict().items():
+            # Put back the vendor index, ex. datetime.date objects for crypto
+            index = prod_dict[prod].index
+            if pd.to_datetime(index).equals(df.index):
+                df.index = index
+            prod_dict[prod] = df
+
+    return panel
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains streaming versions of the indicators in add_all_indicators for live
+    bar feeds.  Each calculator keeps a small fixed-size state and updates in O(1) amortized
+    time per bar, and SignalTracker combines them to emit the same vol_bo, range_bo, ma and bb
+    signals as the batch code, one bar at a time.
+"""
+
+import math
+from collections import deque
+import pandas as pd
+
+from manipulation.manipulation import SIGNAL_LIST
+
+NAN = float('nan')
+
+class RollingMean(object):
+    ''' This class keeps the mean of the last window values in a ring buffer with a running
+        sum.  The sum is recomputed from the buffer once per window of updates so rounding
+        error cannot build up over a long feed.
+
+        Args: window - number of values in the window
+    '''
+    __slots__ = ('window', 'buffer', 'pos', 'count', 'total', 'since_resum')
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = [0.0] * window
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+        self.since_resum = 0
+
+    def update(self, x):
+        ''' Add a value and return the mean of the window, NaN until the window is full '''
+        self.total += x - self.buffer[self.pos]
+        self.buffer[self.pos] = x
+        self.pos = (self.pos + 1) % self.window
+        self.count += 1
+
+        # Recompute the sum from the buffer once per window of updates
+        self.since_resum += 1
+        if self.since_resum >= self.window:
+            self.total = math.fsum(self.buffer)
+            self.since_resum = 0
+
+        return self.value()
+
+    def value(self):
+        ''' Return the mean of the window, NaN until the window is full '''
+        if self.count < self.window:
+            return NAN
+        return self.total / self.window
+
+class RollingStd(object):
+    ''' This class keeps the sample standard deviation of the last window values with running
+        sums of the values and their squares, both centered on the first value seen to keep
+        them accurate, and recomputed from the buffer once per window of updates.
+
+        Args: window - number of values in the window
+    '''
+    __slots__ = ('window', 'buffer', 'pos', 'count', 'shift', 'total', 'total_sq', 'since_resum')
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = [0.0] * window
+        self.pos = 0
+        self.count = 0
+        self.shift = None
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.since_resum = 0
+
+    def update(self, x):
+        ''' Add a value and return the standard deviation of the window '''
+        if self.shift is None:
+            self.shift = x
+        d = x - self.shift
+        old = self.buffer[self.pos]
+
+        self.total += d - old
+        self.total_sq += d * d - old * old
+        self.buffer[self.pos] = d
+        self.pos = (self.pos + 1) % self.window
+        self.count += 1
+
+        # Recompute the sums from the buffer once per window of updates
+        self.since_resum += 1
+        if self.since_resum >= self.window:
+            self.total = math.fsum(self.buffer)
+            self.total_sq = math.fsum(v * v for v in self.buffer)
+            self.since_resum = 0
+
+        return self.value()
+
+    def value(self):
+        ''' Return the standard deviation of the window, NaN until the window is full '''
+        if self.count < self.window or self.window < 2:
+            return NAN
+        var = (self.total_sq - self.total * self.total / self.window) / (self.window - 1)
+        return math.sqrt(var) if var > 0.0 else 0.0
+
+class RollingMax(object):
+    ''' This class keeps the max of the last window values with a monotonic deque of
+        (bar number, value) pairs, so each value is pushed and popped at most once.
+
+        Args: window - number of values in the window
+    '''
+    __slots__ = ('window', 'items', 'count')
+
+    def __init__(self, window):
+        self.window = window
+        self.items = deque()
+        self.count = 0
+
+    def better(self, new, old):
+        ''' Return True if new should replace old at the back of the deque '''
+        return new >= old
+
+    def update(self, x):
+        ''' Add a value and return the max of the window, NaN until the window is full '''
+        items = self.items
+        while items and self.better(x, items[-1][1]):
+            items.pop()
+        items.append((self.count, x))
+        self.count += 1
+
+        # Drop the front once it falls out of the window
+        if items[0][0] <= self.count - 1 - self.window:
+            items.popleft()
+
+        return self.value()
+
+    def value(self):
+        ''' Return the max of the window, NaN until the window is full '''
+        if self.count < self.window:
+            return NAN
+        return self.items[0][1]
+
+class RollingMin(RollingMax):
+    ''' This class keeps the min of the last window values, see RollingMax '''
+    __slots__ = ()
+
+    def better(self, new, old):
+        ''' Return True if new should replace old at the back of the deque '''
+        return new <= old
+
+class BollingerBands(object):
+    ''' This class keeps the moving average and upper/lower bands of the last window closes.
+
+        Args: window - number of bars in the moving average
+              width - number of standard deviations from the average to each band
+    '''
+    __slots__ = ('mean', 'std', 'width')
+
+    def __init__(self, window=20, width=2.0):
+        self.mean = RollingMean(window)
+        self.std = RollingStd(window)
+        self.width = width
+
+    def update(self, close):
+        ''' Add a close and return the (low band, moving average, high band) '''
+        ma = self.mean.update(close)
+        band = self.width * self.std.update(close)
+
+        return ma - band, ma, ma + band
+
+class SignalTracker(object):
+    ''' This class tracks every indicator of add_all_indicators for one symbol.  Each call to
+        update takes one new bar and returns the 12 signals for it in SIGNAL_LIST order, equal
+        to what the batch code gives for that bar (up to exact floating point ties).
+    '''
+    __slots__ = ('ave_vol', 'high_20', 'low_20', 'ma20', 'ma50', 'ma100', 'bands',
+                 'prev_high', 'prev_low')
+
+    def __init__(self):
+        self.ave_vol = RollingMean(20)
+        self.high_20 = RollingMax(20)
+        self.low_20 = RollingMin(20)
+        self.ma20 = RollingMean(20)
+        self.ma50 = RollingMean(50)
+        self.ma100 = RollingMean(100)
+        self.bands = BollingerBands(20, 2.0)
+        self.prev_high = NAN
+        self.prev_low = NAN
+
+    def update(self, high, low, close, volume):
+        ''' This function takes in the high, low, close and volume of a new bar and returns a
+            tuple of 0/1 signals in SIGNAL_LIST order.
+        '''
+        # Volume average and 20 bar range of the bars before this one
+        ave_vol = self.ave_vol.value()
+        high_20 = self.high_20.value()
+        low_20 = self.low_20.value()
+
+        vol_spike = volume > 2 * ave_vol
+        vol_bo_long = int(vol_spike and close > self.prev_high)
+        vol_bo_short = int(vol_spike and close < self.prev_low)
+        range_bo_long = int(high > high_20)
+        range_bo_short = int(low < low_20)
+
+        # Moving averages and bands include this bar
+        ma20 = self.ma20.update(close)
+        ma50 = self.ma50.update(close)
+        ma100 = self.ma100.update(close)
+        bb_low, _, bb_high = self.bands.update(close)
+
+        # Move the previous bar state forward
+        self.ave_vol.update(volume)
+        self.high_20.update(high)
+        self.low_20.update(low)
+        self.prev_high = high
+        self.prev_low = low
+
+        return (vol_bo_long, vol_bo_short, range_bo_long, range_bo_short,
+                int(close > ma20), int(close < ma20),
+                int(close > ma50), int(close < ma50),
+                int(close > ma100), int(close < ma100),
+                int(low < bb_low), int(high > bb_high))
+
+class UniverseTracker(object):
+    ''' This class keeps a SignalTracker per symbol, created on the first bar of each symbol. '''
+    __slots__ = ('trackers',)
+
+    def __init__(self):
+        self.trackers = {}
+
+    def update(self, symbol, high, low, close, volume):
+        ''' Add a bar for symbol and return its signals, see SignalTracker.update '''
+        tracker = self.trackers.get(symbol)
+        if tracker is None:
+            tracker = self.trackers[symbol] = SignalTracker()
+
+        return tracker.update(high, low, close, volume)
+
+def replay(df, tracker=None):
+    ''' This function takes in a dataframe of price information and feeds it bar by bar
+        through a SignalTracker, returning the streamed signals as a dataframe.  It is used to
+        check the streaming signals against add_all_indicators.
+
+        Args: df - dataframe of price information
+              tracker - optional SignalTracker to continue from
+
+        Return: signals_df - dataframe of int8 signal columns named by SIGNAL_LIST
+    '''
+    tracker = tracker or SignalTracker()
+    rows = [tracker.update(h, l, c, v) for h, l, c, v in
+            zip(df['high'].tolist(), df['low'].tolist(), df['close'].tolist(), df['volume'].tolist())]
+
+    return pd.DataFrame(rows, index=df.index, columns=SIGNAL_LIST).astype('int8')
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the parameter sweep engine, which evaluates grids of indicator
+    windows and thresholds instead of the fixed 20/50/100 bar, 2 std and 2x volume
+    settings of add_all_indicators.  Moving averages and bands for every window come from
+    one set of cumulative sum and cumulative square arrays per product, so each extra
+    window is a couple of O(n) array subtractions.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from analysis.analysis import batch_return_stats, STATS_COLUMNS
+
+# Default grid of parameters, the fixed settings of add_all_indicators are included
+DEFAULT_GRID = {'ma_windows': list(range(5, 201)),
+                'bb_windows': [20],
+                'bb_widths': [1.0, 1.5, 2.0, 2.5, 3.0],
+                'range_windows': [10, 20, 50],
+                'vol_windows': [20],
+                'vol_multiples': [1.5, 2.0, 3.0]}
+
+def prefix_sums(values):
+    ''' This function takes in an array and returns its cumulative sum and cumulative sum of
+        squares with a leading zero, so the sum over bars [i - w, i) is cs[i] - cs[i - w].
+        The values are centered on their mean first to keep the sum of squares accurate.
+        NaN values add zero to the sums and are left out of the running count of valid bars,
+        so they only affect the windows they fall in.
+
+        Args: values - numpy array of values
+
+        Return: cs - cumulative sums of the centered values
+                cs2 - cumulative sums of squares of the centered values
+                cn - cumulative counts of the valid (not NaN) values
+                center - the mean that was subtracted
+    '''
+    valid = ~np.isnan(values)
+    center = values[valid].mean() if valid.any() else 0.0
+    centered = np.where(valid, values - center, 0.0)
+
+    cs = np.concatenate([[0.0], np.cumsum(centered)])
+    cs2 = np.concatenate([[0.0], np.cumsum(centered * centered)])
+    cn = np.concatenate([[0], np.cumsum(valid)])
+
+    return cs, cs2, cn, center
+
+def window_mean(cs, cn, center, window):
+    ''' This function takes in prefix sums from prefix_sums and a window length and returns
+        the rolling mean ending at each bar, NaN until the window is full and for windows
+        with a NaN value, like rolling_mean.
+    '''
+    n = len(cs) - 1
+    out = np.full(n, np.nan)
+    if n >= window:
+        full = (cn[window:] - cn[:-window]) == window
+        out[window - 1:] = np.where(full, (cs[window:] - cs[:-window]) / window + center, np.nan)
+
+    return out
+
+def window_std(cs, cs2, cn, window):
+    ''' This function takes in prefix sums from prefix_sums and a window length and returns
+        the rolling sample standard deviation ending at each bar, NaN until the window is full
+        and for windows with a NaN value, like rolling_std.
+    '''
+    n = len(cs) - 1
+    out = np.full(n, np.nan)
+    if n >= window and window > 1:
+        full = (cn[window:] - cn[:-window]) == window
+        s = cs[window:] - cs[:-window]
+        s2 = cs2[window:] - cs2[:-window]
+        var = (s2 - s * s / window) / (window - 1)
+        out[window - 1:] = np.where(full, np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+    return out
+
+def shift(values, periods=1):
+    ''' This function returns an array shifted forward by periods bars, NaN filled '''
+    out = np.full(len(values), np.nan)
+    if len(values) > periods:
+        out[periods:] = values[:-periods]
+
+    return out
+
+def sweep_signals(df, grid=DEFAULT_GRID, timeframe_list=[1, 5, 10, 20]):
+    ''' This function takes in a cleaned dataframe of price information and a grid of
+        parameters, and returns a dataframe of every parameterized long/short signal plus
+        the pct_change columns needed by batch_return_stats.  Signal names carry their
+        parameters, ex. 'ma35_long', 'bb20_1.5sd_short', 'range_bo50_long',
+        'vol_bo20_3x_short', so combine_strategies(df, strategies=None) can
+        still pair them.
+
+        Args: df - cleaned dataframe of price information
+              grid - dict of parameter lists with the keys of DEFAULT_GRID
+              timeframe_list - list of ints that represent timeframes for returns
+
+        Return: signals_df - dataframe of int8 signal columns and pct_change columns
+    '''
+    close = df['close'].to_numpy(dtype=np.float64)
+    high = df['high'].to_numpy(dtype=np.float64)
+    low = df['low'].to_numpy(dtype=np.float64)
+    volume = df['volume'].to_numpy(dtype=np.float64)
+
+    # Shared prefix sums for every moving average, band and volume average
+    cs, cs2, cn, center = prefix_sums(close)
+    vcs, vcs2, vcn, vcenter = prefix_sums(volume)
+
+    columns = {}
+
+    def add(name, long_mask, short_mask):
+        columns[name + '_long'] = long_mask.astype(np.int8)
+        columns[name + '_short'] = short_mask.astype(np.int8)
+
+    # Moving average signals
+    for window in grid.get('ma_windows', []):
+        ma = window_mean(cs, cn, center, window)
+        add('ma{}'.format(window), close > ma, close < ma)
+
+    # Bollinger band signals
+    for window in grid.get('bb_windows', []):
+        ma = window_mean(cs, cn, center, window)
+        std = window_std(cs, cs2, cn, window)
+        for width in grid.get('bb_widths', []):
+            add('bb{}_{:g}sd'.format(window, width), low < ma - width * std, high > ma + width * std)
+
+    # Range breakout signals
+    for window in grid.get('range_windows', []):
+        prev_high = shift(pd.Series(high).rolling(window).max().to_numpy())
+        prev_low = shift(pd.Series(low).rolling(window).min().to_numpy())
+        add('range_bo{}'.format(window), high > prev_high, low < prev_low)
+
+    # Volume breakout signals
+    close_gt_prev_h = close > shift(high)
+    close_lt_prev_l = close < shift(low)
+    for window in grid.get('vol_windows', []):
+        ave_vol = shift(window_mean(vcs, vcn, vcenter, window))
+        for multiple in grid.get('vol_multiples', []):
+            spike = volume > multiple * ave_vol
+            add('vol_bo{}_{:g}x'.format(window, multiple), spike & close_gt_prev_h, spike & close_lt_prev_l)
+
+    # Returns over each timeframe, built like add_all_indicators
+    for timeframe in timeframe_list:
+        columns['pct_change_{}day'.format(timeframe)] = df['close'].pct_change(periods=timeframe).to_numpy()
+
+    return pd.DataFrame(columns, index=df.index)
+
+def sweep_product(product, df, grid=DEFAULT_GRID, timeframe_list=[1, 5, 10, 20]):
+    ''' This function takes in a product and its cleaned dataframe and returns the return
+        statistics of every parameterized signal and timeframe, with the columns of
+        return_stats.
+
+        Args: product - product name
+              df - cleaned dataframe of price information
+              grid - dict of parameter lists with the keys of DEFAULT_GRID
+              timeframe_list - list of ints that represent timeframes for returns
+
+        Return: stats_df - dataframe with STATS_COLUMNS
+    '''
+    signals_df = sweep_signals(df, grid, timeframe_list)
+    signal_list = [col for col in signals_df.columns if not col.startswith('pct_change_')]
+
+    return batch_return_stats(product, signals_df, signal_list, timeframe_list)
+
+def sweep_task(args):
+    ''' This is a helper function to use as a process pool task, see sweep_product '''
+    return sweep_product(*args)
+
+def sweep_all_products(prod_dict, grid=DEFAULT_GRID, timeframe_list=[1, 5, 10, 20], workers=None):
+    ''' This function takes in the dictionary of all cleaned product dataframes and a grid of
+        parameters, and returns one returns dataframe for every product, parameterized signal
+        and timeframe, in the same format as create_returns_df.
+
+        Args: prod_dict - dictionary of name:dataframe key:value pairs for all products
+              grid - dict of parameter lists with the keys of DEFAULT_GRID
+              timeframe_list - list of ints that represent timeframes for returns
+              workers - number of worker processes, None or 1 to sweep serially
+
+        Return: returns_df - dataframe of products, signals, timeframes and return stats
+    '''
+    tasks = [(prod, df, grid, timeframe_list) for prod, df in prod_dict.items()]
+
+    if not workers or workers <= 1:
+        frames = [sweep_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(sweep_task, tasks))
+
+    returns_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=STATS_COLUMNS)
+
+    # Drop null values
+    returns_df.dropna(inplace=True)
+
+    return returns_df
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the helpers shared by every plotting function for showing a
+    figure interactively or writing it to a file when running without a display.
+    matplotlib is only imported by the functions that draw, so runs without plots never
+    pay for importing it.
+"""
+
+import os
+import sys
+
+def use_file_backend():
+    ''' This function switches matplotlib to the non-interactive Agg backend, so figures
+        can be written to files on a machine without a display.  If pyplot has not been
+        imported yet, only the MPLBACKEND setting is made, which pyplot (and any worker
+        process started afterwards) reads when it is first imported.
+    '''
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].switch_backend('Agg')
+    else:
+        os.environ['MPLBACKEND'] = 'Agg'
+
+def show_or_save(save_path=None):
+    ''' This function takes in an optional file path and either shows the current figure
+        or writes it to the file and closes it.
+
+        Args: save_path - file to write the figure to, None to show it interactively
+
+        Return: None - shows or saves the current figure
+    '''
+    import matplotlib.pyplot as plt
+
+    if save_path is None:
+        plt.show()
+    else:
+        plt.savefig(save_path, bbox_inches='tight')
+        plt.close()
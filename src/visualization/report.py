@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+""" This module contains the report renderer, which writes every figure of the analysis to
+    files: the returns chart of each product/signal/timeframe, the outlier chart of each
+    product and the summary plots of the returns dataframes.  The data behind each figure is
+    computed once up front, figures are drawn on worker processes with the Agg backend, and
+    a figure is only drawn again when the data behind it has changed.
+"""
+
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from analysis.analysis import draw_returns, signal_direction
+from data.util import draw_outliers
+from manipulation.manipulation import SIGNAL_LIST
+from visualization.visualization import *
+from visualization.figures import use_file_backend
+
+# File in the figures folder that keeps the fingerprint of the data behind each figure
+MANIFEST_FILE = 'figures.json'
+
+def arg_bytes(arg):
+    ''' This function returns the bytes used to fingerprint one argument of a figure '''
+    if isinstance(arg, (pd.DataFrame, pd.Series, pd.Index)):
+        columns = repr(list(arg.columns)) if isinstance(arg, pd.DataFrame) else ''
+        return columns.encode() + pd.util.hash_pandas_object(arg).to_numpy().tobytes()
+    if isinstance(arg, np.ndarray):
+        return '{}{}'.format(arg.dtype, arg.shape).encode() + np.ascontiguousarray(arg).tobytes()
+
+    return repr(arg).encode()
+
+def fingerprint(func, args):
+    ''' This function takes in a drawing function and its arguments and returns a hash of
+        them, which changes whenever the figure would change.
+    '''
+    h = hashlib.sha1(func.__name__.encode())
+    for arg in args:
+        h.update(arg_bytes(arg))
+
+    return h.hexdigest()
+
+def returns_tasks(prod_dict, signal_list, timeframe_list):
+    ''' This function takes in a dict of transformed product dataframes, a list of signals and
+        a list of timeframes, and returns a figure task for every returns chart.  The signed
+        returns of every signal bar are taken from one array per product, instead of
+        filtering the product dataframe once per chart like plot_returns.
+
+        Return: tasks - list of (file name, draw_returns, args) tuples
+    '''
+    tasks = []
+    for prod, df in prod_dict.items():
+        on = df[signal_list].to_numpy() == 1
+        returns = df[['pct_change_{}day'.format(tf) for tf in timeframe_list]].to_numpy(dtype=np.float64)
+
+        for i, signal in enumerate(signal_list):
+            direction = signal_direction(signal)
+            if direction is None:
+                continue
+            rows = np.flatnonzero(on[:, i])
+            dates = df.index[rows]
+
+            for j, timeframe in enumerate(timeframe_list):
+                values = direction * returns[rows, j]
+                valid = values[~np.isnan(values)]
+                mean_pc = valid.mean() if len(valid) else np.nan
+                name = 'returns_{}_{}_{}day.png'.format(prod, signal, timeframe)
+                tasks.append((name, draw_returns,
+                              (dates, values, mean_pc, signal, 'pct_change_{}day'.format(timeframe))))
+
+    return tasks
+
+def outlier_tasks(prod_dict):
+    ''' This function takes in a dict of product dataframes and returns a figure task for the
+        outlier chart of every product, with closes more than 3 stds from the mean marked
+        like check_outliers.
+
+        Return: tasks - list of (file name, draw_outliers, args) tuples
+    '''
+    tasks = []
+    for prod, df in prod_dict.items():
+        close = df['close']
+        locs = np.flatnonzero(((close - close.mean()).abs() / close.std()).to_numpy() > 3.0).tolist()
+        tasks.append(('outliers_{}.png'.format(prod), draw_outliers, (df.index, close, locs)))
+
+    return tasks
+
+def summary_tasks(returns_df=None, df_yearly_return=None):
+    ''' This function takes in the returns dataframe and the yearly returns dataframe, either
+        can be None, and returns a figure task for each summary plot with only the columns it
+        uses.
+
+        Return: tasks - list of (file name, plot function, args) tuples
+    '''
+    tasks = []
+    if returns_df is not None:
+        tasks.append(('distplot_ave_return.png', plot_dist_ave_return, (returns_df[['ave_return']],)))
+        tasks.append(('stripplot_signal.png', plot_ave_return_by_signal, (returns_df[['signal', 'ave_return']],)))
+        tasks.append(('heatmap.png', plot_heatmap, (returns_df[['product', 'signal', 'ave_return']],)))
+    if df_yearly_return is not None:
+        tasks.append(('heatmap_final.png', plot_heatmap_final,
+                      (df_yearly_return[['product', 'signal', 'ave_yearly_return']],)))
+
+    return tasks
+
+def render_chunk(tasks):
+    ''' This is a helper function to use as a process pool task.  It takes in a list of
+        (path, function, args) tuples, draws each figure to its path with the Agg backend and
+        returns a list of (path, seconds taken) tuples.
+    '''
+    use_file_backend()
+    results = []
+    for path, func, args in tasks:
+        start = time.perf_counter()
+        func(*args, save_path=path)
+        results.append((path, time.perf_counter() - start))
+
+    return results
+
+def render_report(folder, prod_dict=None, returns_df=None, df_yearly_return=None,
+                  signal_list=SIGNAL_LIST, timeframe_list=[1, 5, 10, 20], workers=None, chunk_size=None,
+                  force=False):
+    ''' This function writes every figure of the analysis to png files in folder.  A figure
+        whose file exists and whose data is unchanged since it was written is skipped, using
+        the fingerprints kept in MANIFEST_FILE.  Figures are drawn on a process pool when
+        workers is more than 1.
+
+        Args: folder - folder to write the figures to
+              prod_dict - optional dict of transformed product dataframes, for the returns and
+                          outlier charts
+              returns_df - optional returns dataframe, for the summary plots
+              df_yearly_return - optional yearly returns dataframe, for the final heatmap
+              signal_list - list of signals to chart
+              timeframe_list - list of timeframes to chart
+              workers - number of worker processes, None or 1 to draw serially
+              chunk_size - number of figures per pool task, None to split them evenly
+              force - True to draw every figure even if it is unchanged
+
+        Return: report_df - dataframe of figure, status ('written' or 'skipped') and seconds
+    '''
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    # Build every figure task from data computed once
+    tasks = summary_tasks(returns_df, df_yearly_return)
+    if prod_dict is not None:
+        tasks += outlier_tasks(prod_dict)
+        tasks += returns_tasks(prod_dict, signal_list, timeframe_list)
+
+    # Read the fingerprints of the figures already written
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    # Keep only figures that are missing or whose data changed
+    todo, report = [], []
+    for name, func, args in tasks:
+        key = fingerprint(func, args)
+        path = os.path.join(folder, name)
+        if not force and manifest.get(name) == key and os.path.exists(path):
+            report.append([name, 'skipped', 0.0])
+        else:
+            todo.append((path, func, args))
+            manifest[name] = key
+
+    # Draw the figures serially or in chunks on a process pool
+    if not workers or workers <= 1:
+        results = render_chunk(todo)
+    else:
+        if chunk_size is None:
+            chunk_size = max(1, len(todo) // (workers * 4))
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=use_file_backend) as pool:
+            results = [result for chunk in pool.map(render_chunk, chunks) for result in chunk]
+
+    for path, seconds in results:
+        report.append([os.path.basename(path), 'written', seconds])
+
+    # Save the fingerprints for the next run
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return pd.DataFrame(report, columns=['figure', 'status', 'seconds'])
@@ -2,24 +2,28 @@
 # # -*- coding: utf-8 -*-
 
 """ This module contains all the functions for creating visualizations of the exploratory
-    data analysis completed by other modules.
+    data analysis completed by other modules.  matplotlib, seaborn and scipy are imported
+    inside each function, so importing this module for a run without plots stays cheap.
 """
 
 import pandas as pd
 import numpy as np
-from scipy.stats import norm
-import matplotlib.pyplot as plt
-import seaborn as sns
+from visualization.figures import show_or_save
 
-def plot_dist_ave_return(df, column='ave_return'):
+def plot_dist_ave_return(df, column='ave_return', save_path=None):
     ''' This takes in a dataframe and column name and then plots the distribution
         of the corresponding data.
 
         Args: df - dataframe of price and indicator information
               column - column of data to plot
+              save_path - optional file to write the plot to instead of showing it
 
         Return: None - plots the distribution
     '''
+    from scipy.stats import norm
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Create figure
     fig, ax = plt.subplots(figsize=(18,7))
 
@@ -27,16 +31,20 @@ def plot_dist_ave_return(df, column='ave_return'):
     ax = sns.distplot(df[column], fit=norm)
     ax.set(title='Distribution of {}'.format(column), xlabel=column)
 
-    plt.show()
+    show_or_save(save_path)
 
-def plot_ave_return_by_signal(df):
+def plot_ave_return_by_signal(df, save_path=None):
     ''' This function takes in a dataframe of price, indicator and return information
         and creates a strip plot of each ave_return by signal.
 
         Args: df - dataframe of return information
+              save_path - optional file to write the plot to instead of showing it
 
         Return: None - plots the returns by signal
     '''
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Create figure
     fig, ax = plt.subplots(figsize=(18,7))
 
@@ -45,16 +53,20 @@ def plot_ave_return_by_signal(df):
     ax.set(title='Ave Return by Signal', xlabel='Signal', ylabel='Ave Return (%)')
     ax.tick_params(axis='x', rotation=90)
 
-    plt.show()
+    show_or_save(save_path)
 
-def plot_heatmap(df):
+def plot_heatmap(df, save_path=None):
     ''' This function takes in a dataframe of price, indicator and return information
         and creates a heatmap of ave_returns by product and signal.
 
         Args: df - dataframe of return information
+              save_path - optional file to write the plot to instead of showing it
 
         Return: None - plots the heatmap
     '''
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Create figure
     fig, ax = plt.subplots(figsize=(18,7))
 
@@ -67,16 +79,20 @@ def plot_heatmap(df):
     ax.tick_params(axis='x', rotation=90)
     ax.tick_params(axis='y', rotation=45)
 
-    plt.show()
+    show_or_save(save_path)
 
-def plot_heatmap_final(df):
+def plot_heatmap_final(df, save_path=None):
     ''' This function takes in a dataframe of return information and creates a heatmap
         of ave_yearly_return by product and signal.
 
         Args: df - dataframe of return information
+              save_path - optional file to write the plot to instead of showing it
 
         Return: None - plots the heatmap
     '''
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Create figure
     fig, ax = plt.subplots(figsize=(10,7))
 
@@ -87,4 +103,4 @@ def plot_heatmap_final(df):
     sns.heatmap(df1, annot=True, fmt=".2%", ax=ax, cbar_kws={'ticks': [0, 5, 10, 15]}, vmin=0, vmax=15)
     ax.set(title='Ave Yearly Return by Product/Signal Combination')
 
-    plt.show()
+    show_or_save(save_path)